@@ -0,0 +1,93 @@
+from collections import OrderedDict
+from copy import copy
+from hashlib import md5
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from foodgram.cache import bump_version, get_version, local_max_age
+from foodgram.db import primary
+
+TOKEN_AUTH_VERSION_KEY = 'auth:token:{}'
+
+
+class TokenCache:
+    """Ограниченный LRU-кэш токен → пользователь с временем жизни.
+
+    Кэш локален для процесса, у каждого токена есть версия в общем
+    кэше. Версия читается до запроса токена из БД, а при выходе,
+    удалении токена, смене пароля или деактивации пользователя
+    увеличивается после коммита, поэтому запись, прочитанная из БД до
+    отзыва, перестаёт приниматься во всех процессах. Запись живёт
+    local_max_age(TOKEN_CACHE_TTL) секунд, как и другие копии в памяти
+    процессов."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def version_key(key):
+        return TOKEN_AUTH_VERSION_KEY.format(md5(key.encode()).hexdigest())
+
+    def version(self, key):
+        return get_version(self.version_key(key))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, token, expires, version = entry
+            if expires < monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        if version != self.version(key):
+            self.discard(key)
+            return None
+        return copy(user), token
+
+    def set(self, key, user, token, version):
+        """Кэширует токен под версией, прочитанной до запроса к БД"""
+        expires = monotonic() + local_max_age(settings.TOKEN_CACHE_TTL)
+        with self._lock:
+            self._entries[key] = (user, token, expires, version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def revoke(self, keys):
+        """Сбрасывает закэшированные токены во всех процессах"""
+        for key in keys:
+            bump_version(self.version_key(key))
+            self.discard(key)
+
+    def revoke_user(self, user_id):
+        """Сбрасывает все закэшированные токены пользователя"""
+        self.revoke(Token.objects.filter(user_id=user_id).values_list(
+            'key', flat=True))
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, не обращающаяся к БД для известных токенов"""
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        version = token_cache.version(key)
+        with primary():
+            user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token, version)
+        return copy(user), token
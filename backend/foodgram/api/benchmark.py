@@ -0,0 +1,279 @@
+import base64
+import gc
+import io
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from itertools import count
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.db import connections, reset_queries, transaction
+from django.db.models import Count
+from django.test.utils import (CaptureQueriesContext, setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.urls import router
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+# Эндпоинты djoser, которые меняют учётные данные или отправляют письма:
+# в замерах на реальной базе они не участвуют
+SKIPPED_URL_NAMES = frozenset((
+    'users-activation', 'users-resend-activation', 'users-reset-password',
+    'users-reset-password-confirm', 'users-reset-username',
+    'users-reset-username-confirm', 'users-set-password',
+    'users-set-username',
+))
+
+
+class Fixtures:
+    """Объекты из текущей базы, на которых выполняются сценарии.
+
+    Пользователь — автор рецептов с наибольшим числом подписок, чтобы
+    подписки и флаги избранного в ответах были непустыми."""
+
+    def __init__(self):
+        self.user = (
+            User.objects.filter(recipes__isnull=False)
+            .annotate(subscriptions=Count('follower', distinct=True))
+            .order_by('-subscriptions', 'id').first()
+        )
+        if self.user is None:
+            raise LookupError('В базе нет рецептов, запустите generatedata')
+        self.token, _ = Token.objects.get_or_create(user=self.user)
+        self.own_recipe = self.user.recipes.order_by('-id').first()
+        self.recipe = Recipe.objects.order_by('-pub_date', '-id').first()
+        self.free_recipe = Recipe.objects.exclude(
+            favorites__user=self.user).exclude(
+            shoppingcarts__user=self.user).order_by('-id').first()
+        self.author = User.objects.exclude(id=self.user.id).exclude(
+            following__user=self.user).order_by('id').first()
+        self.other_user = User.objects.exclude(
+            id=self.user.id).order_by('id').first()
+        self.ingredient = Ingredient.objects.order_by('id').first()
+        self.pantry = list(self.recipe.recipeingredients.values_list(
+            'ingredient_id', flat=True))
+        self.tag = Tag.objects.order_by('id').first()
+        self.names = count(1)
+        self.users = count(1)
+
+    def client(self, auth=True):
+        client = APIClient()
+        if auth:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        return client
+
+    def new_recipe(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48), (230, 180, 120)).save(buffer, 'PNG')
+        return {
+            'name': f'Замер {self.user.id}-{next(self.names)}',
+            'text': 'Рецепт для замера',
+            'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': [{'id': self.ingredient.id, 'amount': 10}],
+            'image': ('data:image/png;base64,'
+                      + base64.b64encode(buffer.getvalue()).decode()),
+        }
+
+    def new_user(self):
+        number = f'{self.user.id}-{next(self.users)}'
+        return {
+            'email': f'benchmark-{number}@example.com',
+            'username': f'benchmark-{number}',
+            'first_name': 'Замер',
+            'last_name': 'Замер',
+            'password': 'Kx7-pelmeni-vareniki',
+        }
+
+
+class Scenario:
+    """Один запрос к API.
+
+    url_name и kwargs задают адрес, data — тело или параметры запроса.
+    setup выполняется перед замером и возвращает адрес, если его нужно
+    подменить; undo после замера возвращает базу в исходное состояние."""
+
+    def __init__(self, name, url_name, method='get', kwargs=None,
+                 data=None, auth=True, setup=None, undo=None):
+        self.name = name
+        self.url_name = url_name
+        self.method = method
+        self.kwargs = kwargs
+        self.data = data
+        self.auth = auth
+        self.setup = setup
+        self.undo = undo
+
+    def url(self, fixtures):
+        kwargs = self.kwargs(fixtures) if self.kwargs else None
+        return reverse(self.url_name, kwargs=kwargs)
+
+    def request(self, client, fixtures, url):
+        data = self.data(fixtures) if self.data else None
+        return getattr(client, self.method)(url, data, format=(
+            None if self.method == 'get' else 'json'))
+
+
+def create_recipe(client, fixtures, url):
+    response = client.post(reverse('recipes-list'), fixtures.new_recipe(),
+                           format='json')
+    return reverse('recipes-detail', kwargs={'pk': response.json()['id']})
+
+
+def delete_created(client, fixtures, url, response):
+    client.delete(reverse('recipes-detail',
+                          kwargs={'pk': response.json()['id']}))
+
+
+def delete_user(client, fixtures, url, response):
+    User.objects.filter(id=response.json()['id']).delete()
+
+
+def repeat(method):
+    def call(client, fixtures, url, *args):
+        getattr(client, method)(url)
+    return call
+
+
+def recipe(fixtures):
+    return {'pk': fixtures.recipe.id}
+
+
+def free_recipe(fixtures):
+    return {'pk': fixtures.free_recipe.id}
+
+
+def author(fixtures):
+    return {'id': fixtures.author.id}
+
+
+SCENARIOS = (
+    Scenario('TagsViewSet.list', 'tags-list'),
+    Scenario('TagsViewSet.retrieve', 'tags-detail',
+             kwargs=lambda fixtures: {'pk': fixtures.tag.id}),
+    Scenario('IngredientViewSet.list', 'ingredients-list',
+             data=lambda fixtures: {'name': fixtures.ingredient.name[:2]}),
+    Scenario('IngredientViewSet.retrieve', 'ingredients-detail',
+             kwargs=lambda fixtures: {'pk': fixtures.ingredient.id}),
+    Scenario('RecipeViewSet.list', 'recipes-list'),
+    Scenario('RecipeViewSet.list limit=50', 'recipes-list',
+             data=lambda fixtures: {'limit': 50}),
+    Scenario('RecipeViewSet.list anonymous', 'recipes-list', auth=False),
+    Scenario('RecipeViewSet.list is_favorited', 'recipes-list',
+             data=lambda fixtures: {'is_favorited': 1}),
+    Scenario('RecipeViewSet.list tags', 'recipes-list',
+             data=lambda fixtures: {'tags': fixtures.tag.slug}),
+    Scenario('RecipeViewSet.retrieve', 'recipes-detail', kwargs=recipe),
+    Scenario('RecipeViewSet.feed', 'recipes-feed'),
+    Scenario('RecipeViewSet.pantry', 'recipes-pantry',
+             data=lambda fixtures: {'ingredients': fixtures.pantry[1:],
+                                    'missing': 2}),
+    Scenario('RecipeViewSet.similar', 'recipes-similar', kwargs=recipe),
+    Scenario('RecipeViewSet.create', 'recipes-list', method='post',
+             data=Fixtures.new_recipe, undo=delete_created),
+    Scenario('RecipeViewSet.partial_update', 'recipes-detail',
+             method='patch',
+             kwargs=lambda fixtures: {'pk': fixtures.own_recipe.id},
+             data=lambda fixtures: {'cooking_time': 15}),
+    Scenario('RecipeViewSet.destroy', 'recipes-detail', method='delete',
+             kwargs=recipe, setup=create_recipe),
+    Scenario('RecipeViewSet.favorite', 'recipes-favorite', method='post',
+             kwargs=free_recipe, undo=repeat('delete')),
+    Scenario('RecipeViewSet.favorite delete', 'recipes-favorite',
+             method='delete', kwargs=free_recipe, setup=repeat('post')),
+    Scenario('RecipeViewSet.shopping_cart', 'recipes-shopping-cart',
+             method='post', kwargs=free_recipe, undo=repeat('delete')),
+    Scenario('RecipeViewSet.shopping_cart delete', 'recipes-shopping-cart',
+             method='delete', kwargs=free_recipe, setup=repeat('post')),
+    Scenario('RecipeViewSet.download_shopping_cart',
+             'recipes-download-shopping-cart'),
+    Scenario('SubcsribeView.list', 'users-list'),
+    Scenario('SubcsribeView.create', 'users-list', method='post',
+             auth=False, data=Fixtures.new_user, undo=delete_user),
+    Scenario('SubcsribeView.retrieve', 'users-detail',
+             kwargs=lambda fixtures: {'id': fixtures.other_user.id}),
+    Scenario('SubcsribeView.me', 'users-me'),
+    Scenario('SubcsribeView.subscriptions', 'users-subscriptions'),
+    Scenario('SubcsribeView.subscriptions recipes_limit=3',
+             'users-subscriptions',
+             data=lambda fixtures: {'recipes_limit': 3}),
+    Scenario('SubcsribeView.subscribe', 'users-subscribe', method='post',
+             kwargs=author, undo=repeat('delete')),
+    Scenario('SubcsribeView.subscribe delete', 'users-subscribe',
+             method='delete', kwargs=author, setup=repeat('post')),
+    Scenario('api-root', 'api-root'),
+)
+
+
+def uncovered_url_names(scenarios=SCENARIOS):
+    """Эндпоинты роутера, для которых нет ни одного сценария"""
+    covered = {scenario.url_name for scenario in scenarios}
+    return sorted({url.name for url in router.urls}
+                  - covered - SKIPPED_URL_NAMES)
+
+
+@contextmanager
+def rolled_back():
+    """Окружение тестового клиента и транзакция, которая откатывается
+    после замеров, чтобы сценарии не оставляли следов в базе"""
+    setup_test_environment()
+    try:
+        with transaction.atomic():
+            yield
+            transaction.set_rollback(True)
+    finally:
+        teardown_test_environment()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(scenario, fixtures, iterations):
+    """Выполняет сценарий iterations раз после одного прогревочного
+    запроса и возвращает задержки, число запросов к БД и пик памяти"""
+    client = fixtures.client(scenario.auth)
+    timings, queries, peak = [], [], 0
+    gc.collect()
+    for iteration in range(iterations + 2):
+        url = scenario.url(fixtures)
+        if scenario.setup:
+            url = scenario.setup(client, fixtures, url) or url
+        reset_queries()
+        trace = iteration == iterations + 1
+        if trace:
+            tracemalloc.start()
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connection))
+                        for connection in connections.all()]
+            started = perf_counter()
+            response = scenario.request(client, fixtures, url)
+            response.getvalue()
+            elapsed = perf_counter() - started
+            # Считаем до undo: его запрос сбросит журнал запросов к БД
+            executed = sum(len(context) for context in captured)
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if response.status_code >= 400:
+            raise AssertionError(
+                f'{scenario.name}: {response.status_code} '
+                f'{response.getvalue()[:200].decode(errors="replace")}')
+        if scenario.undo:
+            scenario.undo(client, fixtures, url, response)
+        if 0 < iteration <= iterations:
+            timings.append(elapsed)
+            queries.append(executed)
+    return {
+        'p50_ms': round(percentile(timings, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+        'queries': max(queries),
+        'peak_kb': round(peak / 1024, 1),
+    }
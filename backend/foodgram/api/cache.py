@@ -0,0 +1,39 @@
+from hashlib import md5
+from time import monotonic, sleep
+
+from django.conf import settings
+
+from foodgram.cache import get_cache
+
+
+def make_key(prefix, request, *versions):
+    url = md5(request.build_absolute_uri().encode()).hexdigest()
+    return ':'.join(('response', prefix, *map(str, versions), url))
+
+
+def get_or_build(key, build):
+    """Возвращает значение из кэша или строит его.
+
+    Значение строит только процесс, захвативший блокировку, остальные
+    ждут его результата, чтобы популярный ключ не пересобирали все
+    воркеры одновременно."""
+    cache = get_cache()
+    data = cache.get(key)
+    if data is not None:
+        return data
+    lock_key = f'{key}:lock'
+    lock_timeout = settings.RESPONSE_CACHE_LOCK_TIMEOUT
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            data = build()
+            cache.set(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+        finally:
+            cache.delete(lock_key)
+        return data
+    deadline = monotonic() + lock_timeout
+    while monotonic() < deadline:
+        sleep(0.05)
+        data = cache.get(key)
+        if data is not None:
+            return data
+    return build()
@@ -0,0 +1,83 @@
+import gzip
+from hashlib import md5
+from threading import Lock
+
+import brotli
+from django.http import HttpResponse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import quote_etag
+
+from foodgram.cache import CATALOG_VERSION_KEY, LocalCopy
+from foodgram.db import primary
+
+ENCODINGS = ('br', 'gzip')
+
+
+def compress(body):
+    """Тело ответа без сжатия, в gzip и brotli, каждое со своим
+    сильным ETag: у разных представлений ETag обязан различаться"""
+    digest = md5(body).hexdigest()
+    return {
+        'identity': (quote_etag(digest), body),
+        'gzip': (quote_etag(f'{digest}-gzip'),
+                 gzip.compress(body, compresslevel=9, mtime=0)),
+        'br': (quote_etag(f'{digest}-br'), brotli.compress(body)),
+    }
+
+
+def choose_encoding(accept_encoding):
+    """Лучшее из поддерживаемых сжатий, которое принимает клиент"""
+    accepted = set()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = params.strip()
+        try:
+            if quality.startswith('q=') and not float(quality[2:]):
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip().lower())
+    for encoding in ENCODINGS:
+        if encoding in accepted or '*' in accepted:
+            return encoding
+    return 'identity'
+
+
+class CatalogCache:
+    """Готовые тела ответов справочников тэгов и ингредиентов.
+
+    Каждое тело — копия в памяти процесса, сверяемая с версией
+    каталога на каждом запросе и пересобираемая не реже раза в
+    CATALOG_CACHE_MAX_AGE секунд (LocalCopy)."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._copies = {}
+
+    def get(self, name, build):
+        with self._lock:
+            copy = self._copies.setdefault(name, LocalCopy(
+                CATALOG_VERSION_KEY, max_age='CATALOG_CACHE_MAX_AGE'))
+
+        def build_compressed():
+            with primary():
+                return compress(build())
+        return copy.get(build_compressed)
+
+    def response(self, request, name, build):
+        encoding = choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        etag, body = self.get(name, build)[encoding]
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type='application/json')
+            if encoding != 'identity':
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+
+catalog_cache = CatalogCache()
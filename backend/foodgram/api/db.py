@@ -0,0 +1,106 @@
+import math
+from hashlib import md5
+from itertools import count
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from foodgram.cache import get_cache
+from foodgram.db import current_replica
+
+STICKY_KEY = 'db:primary:{}'
+
+POSTGRES_LAG = '''
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+'''
+
+
+class ReplicaRouter:
+    """Чтения внутри запроса, для которого выбрана реплика, идут в неё,
+    все остальные чтения и любые записи — в основную базу"""
+
+    def db_for_read(self, model, **hints):
+        return current_replica.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class ReplicaSelector:
+    """Выбор реплики по кругу или с наименьшим отставанием.
+
+    Отставание каждой реплики измеряется не чаще раза в
+    DATABASE_REPLICA_LAG_CHECK_INTERVAL секунд; реплики, отстающие
+    больше DATABASE_REPLICA_MAX_LAG или недоступные, пропускаются."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._turn = count()
+        self._lags = {}
+        self._checked = -math.inf
+
+    def lag(self, alias):
+        connection = connections[alias]
+        if connection.vendor != 'postgresql':
+            return 0
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(POSTGRES_LAG)
+                lag = cursor.fetchone()[0]
+        except DatabaseError:
+            return math.inf
+        return math.inf if lag is None else float(lag)
+
+    def lags(self):
+        with self._lock:
+            stale = (monotonic() - self._checked
+                     >= settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL)
+            if stale:
+                self._checked = monotonic()
+        if stale:
+            self._lags = {alias: self.lag(alias)
+                          for alias in settings.DATABASE_REPLICAS}
+        return self._lags
+
+    def choose(self):
+        lags = self.lags()
+        max_lag = settings.DATABASE_REPLICA_MAX_LAG
+        available = [alias for alias in settings.DATABASE_REPLICAS
+                     if lags.get(alias, 0) <= max_lag]
+        if not available:
+            return None
+        if settings.DATABASE_REPLICA_SELECTION == 'least_lag':
+            return min(available, key=lambda alias: lags.get(alias, 0))
+        return available[next(self._turn) % len(available)]
+
+
+replica_selector = ReplicaSelector()
+
+
+def client_key(request):
+    """Ключ клиента для закрепления за основной базой: токен, сессия
+    или адрес"""
+    credentials = (request.META.get('HTTP_AUTHORIZATION')
+                   or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+                   or request.META.get('HTTP_X_REAL_IP')
+                   or request.META.get('REMOTE_ADDR', ''))
+    return STICKY_KEY.format(md5(credentials.encode()).hexdigest())
+
+
+def pin_to_primary(request):
+    """После записи чтения клиента какое-то время идут в основную базу,
+    чтобы он видел свои изменения несмотря на отставание реплик"""
+    get_cache().set(client_key(request), 1,
+                    settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(request):
+    return get_cache().get(client_key(request)) is not None
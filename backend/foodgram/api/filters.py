@@ -1,14 +1,28 @@
-﻿from django_filters.rest_framework import FilterSet, filters
+﻿from django.db.models import Exists, OuterRef
+from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+
+TAGS_MODE_ANY = 'any'
+TAGS_MODE_ALL = 'all'
 
 
 class RecipeFilter(FilterSet):
-    """Фильтр по рецептам"""
+    """Фильтр по рецептам.
+
+    Тэги, избранное и корзина проверяются подзапросами EXISTS, а не
+    соединениями, поэтому рецепт не повторяется в выдаче при нескольких
+    тэгах. ?tags_mode=all оставляет рецепты со всеми указанными тэгами."""
     tags = filters.ModelMultipleChoiceFilter(
         queryset=Tag.objects.all(),
         field_name='tags__slug',
         to_field_name='slug',
+        method='get_tags'
+    )
+    tags_mode = filters.ChoiceFilter(
+        choices=((TAGS_MODE_ANY, 'Любой из тэгов'),
+                 (TAGS_MODE_ALL, 'Все тэги')),
+        method='get_tags_mode'
     )
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited'
@@ -16,21 +30,49 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(
+        method='get_search'
+    )
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'tags_mode', 'is_favorited',
+                  'is_in_shopping_cart', 'search')
 
-    def get_is_favorited(self, queryset, name, value):
-        if self.request.user.is_authenticated and value:
-            return queryset.filter(favorites__user=self.request.user)
+    def get_tags(self, queryset, name, value):
+        tag_ids = {tag.id for tag in value}
+        if not tag_ids:
+            return queryset
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk'))
+        if self.form.cleaned_data.get('tags_mode') != TAGS_MODE_ALL:
+            return queryset.filter(
+                Exists(recipe_tags.filter(tag_id__in=tag_ids)))
+        for tag_id in tag_ids:
+            queryset = queryset.filter(
+                Exists(recipe_tags.filter(tag_id=tag_id)))
         return queryset
 
-    def get_is_in_shopping_cart(self, queryset, name, value):
+    def get_tags_mode(self, queryset, name, value):
+        return queryset
+
+    def get_user_recipes(self, queryset, model, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(shoppingcarts__user=self.request.user)
+            return queryset.filter(Exists(model.objects.filter(
+                user=self.request.user, recipe_id=OuterRef('pk'))))
         return queryset
 
+    def get_is_favorited(self, queryset, name, value):
+        return self.get_user_recipes(queryset, Favorite, value)
+
+    def get_is_in_shopping_cart(self, queryset, name, value):
+        return self.get_user_recipes(queryset, ShoppingCart, value)
+
+    def get_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return queryset.search(value)
+
 
 class IngredientFilter(FilterSet):
     name = filters.CharFilter(
@@ -0,0 +1,90 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import (SCENARIOS, Fixtures, rolled_back, run,
+                           uncovered_url_names)
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку (p50/p95), число запросов к БД и пик памяти '
+            'на каждом эндпоинте API и сравнивает с сохранённым замером')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=20,
+            help='Сколько раз выполнить каждый сценарий')
+        parser.add_argument(
+            '--only',
+            help='Выполнить только сценарии, в названии которых есть строка')
+        parser.add_argument(
+            '--save', metavar='PATH',
+            help='Сохранить результаты в JSON-файл')
+        parser.add_argument(
+            '--compare', metavar='PATH',
+            help='Сравнить с результатами из JSON-файла')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Допустимый рост p95 относительно сохранённого замера')
+
+    def handle(self, *args, **options):
+        only = options['only']
+        scenarios = [scenario for scenario in SCENARIOS
+                     if not only or only in scenario.name]
+        for url_name in uncovered_url_names():
+            self.stderr.write(f'Нет сценария для эндпоинта {url_name}')
+        results = {}
+        try:
+            with rolled_back():
+                fixtures = Fixtures()
+                for scenario in scenarios:
+                    results[scenario.name] = run(
+                        scenario, fixtures, options['iterations'])
+                    self.report(scenario.name, results[scenario.name])
+        except (LookupError, AssertionError) as error:
+            raise CommandError(error)
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as file:
+                json.dump({
+                    'dataset': {'users': User.objects.count(),
+                                'recipes': Recipe.objects.count()},
+                    'iterations': options['iterations'],
+                    'results': results,
+                }, file, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self.compare(results, options['compare'], options['tolerance'])
+
+    def report(self, name, result):
+        self.stdout.write(
+            f'{name:<48} p50 {result["p50_ms"]:>8.2f} мс  '
+            f'p95 {result["p95_ms"]:>8.2f} мс  '
+            f'запросов {result["queries"]:>3}  '
+            f'память {result["peak_kb"]:>8.1f} КБ')
+
+    def compare(self, results, path, tolerance):
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+        regressions = []
+        for name, result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            if result['queries'] > base['queries']:
+                regressions.append(
+                    f'{name}: запросов {base["queries"]} → '
+                    f'{result["queries"]}')
+            # Рост меньше миллисекунды считается шумом
+            limit = max(base['p95_ms'] * (1 + tolerance),
+                        base['p95_ms'] + 1)
+            if result['p95_ms'] > limit:
+                regressions.append(
+                    f'{name}: p95 {base["p95_ms"]} → {result["p95_ms"]} мс')
+        if regressions:
+            raise CommandError(
+                'Регрессии относительно замера:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS(
+            'Регрессий относительно замера нет'))
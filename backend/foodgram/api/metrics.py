@@ -0,0 +1,113 @@
+import os
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+import prometheus_client as prometheus
+from prometheus_client import multiprocess
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class RequestMetrics:
+    """Счётчики одного запроса: SQL-запросы, время в БД,
+    в сериализаторах и общее время обработки"""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.view_name = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.statements = Counter()
+        self._serializer_depth = 0
+
+    @property
+    def total_time(self):
+        return perf_counter() - self.started
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """Обёртка для connection.execute_wrapper"""
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def duplicates(self, threshold):
+        """Запросы, повторённые threshold и более раз — признак N+1"""
+        return [(sql, count) for sql, count in self.statements.most_common()
+                if count >= threshold]
+
+
+@contextmanager
+def track_serializer():
+    """Учитывает время сериализации; вложенные вызовы не суммируются"""
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    metrics._serializer_depth += 1
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        metrics._serializer_depth -= 1
+        if not metrics._serializer_depth:
+            metrics.serializer_time += perf_counter() - started
+
+
+REQUESTS = prometheus.Counter(
+    'foodgram_requests_total', 'Число HTTP-запросов',
+    ('view', 'method', 'status'))
+ERRORS = prometheus.Counter(
+    'foodgram_request_errors_total', 'Число ответов с кодом 5xx',
+    ('view', 'method'))
+LATENCY = prometheus.Histogram(
+    'foodgram_request_duration_seconds', 'Время обработки запроса',
+    ('view', 'method'),
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+DB_QUERIES = prometheus.Histogram(
+    'foodgram_request_db_queries', 'Число SQL-запросов на HTTP-запрос',
+    ('view', 'method'),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144))
+DB_TIME = prometheus.Histogram(
+    'foodgram_request_db_seconds', 'Время SQL-запросов на HTTP-запрос',
+    ('view', 'method'),
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+
+
+def observe(request, response, metrics):
+    """Добавляет метрики завершённого запроса в счётчики Prometheus"""
+    labels = (metrics.view_name or 'unresolved', request.method)
+    REQUESTS.labels(*labels, response.status_code).inc()
+    if response.status_code >= 500:
+        ERRORS.labels(*labels).inc()
+    LATENCY.labels(*labels).observe(metrics.total_time)
+    DB_QUERIES.labels(*labels).observe(metrics.queries)
+    DB_TIME.labels(*labels).observe(metrics.db_time)
+
+
+def export():
+    """Метрики в текстовом формате Prometheus.
+
+    Под gunicorn с PROMETHEUS_MULTIPROC_DIR каждый воркер пишет значения
+    в свои mmap-файлы в общем каталоге, и экспорт суммирует их по всем
+    процессам, поэтому ответ не зависит от того, какой воркер его отдал."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = prometheus.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus.REGISTRY
+    return prometheus.generate_latest(registry)
+
+
+class TimedSerializerMixin:
+    """Миксин сериализатора для учёта времени сериализации в метриках"""
+
+    def to_representation(self, instance):
+        with track_serializer():
+            return super().to_representation(instance)
@@ -0,0 +1,109 @@
+import json
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+from api.db import is_pinned, pin_to_primary, replica_selector
+from api.metrics import RequestMetrics, current_metrics, observe
+from foodgram.db import current_replica
+
+logger = logging.getLogger('api.metrics')
+
+
+def get_view_name(request, view_func):
+    """Имя view вида RecipeViewSet.list или SubcsribeView.subscriptions"""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__name__', repr(view_func))
+    method = request.method.lower()
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{cls.__name__}.{actions.get(method, method)}'
+
+
+class RequestMetricsMiddleware:
+    """Считает SQL-запросы, время в БД, в сериализаторах и общее время
+    запроса, отдаёт их в заголовке Server-Timing, пишет в лог
+    и накапливает для /api/metrics/.
+
+    Включается настройкой REQUEST_METRICS_ENABLED; выключенный
+    middleware Django убирает из цепочки целиком."""
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        self.report(request, response, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        current_metrics.get().view_name = get_view_name(request, view_func)
+
+    def report(self, request, response, metrics):
+        observe(request, response, metrics)
+        total = metrics.total_time
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={metrics.db_time * 1000:.1f};'
+            f'desc="{metrics.queries} queries"',
+            f'serializer;dur={metrics.serializer_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+        duplicates = metrics.duplicates(
+            settings.REQUEST_METRICS_DUPLICATE_THRESHOLD)
+        record = {
+            'view': metrics.view_name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': metrics.queries,
+            'db_ms': round(metrics.db_time * 1000, 1),
+            'serializer_ms': round(metrics.serializer_time * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'duplicate_queries': len(duplicates),
+        }
+        logger.info(json.dumps(record, ensure_ascii=False))
+        for sql, count in duplicates:
+            logger.warning('Возможен N+1 в %s: %d раз %s',
+                           metrics.view_name, count, sql)
+
+
+class ReplicaMiddleware:
+    """Направляет чтения безопасных запросов (GET, HEAD, OPTIONS)
+    в одну из реплик DATABASE_REPLICAS на весь запрос.
+
+    Небезопасные запросы работают с основной базой и закрепляют
+    клиента за ней на DATABASE_REPLICA_STICKY_SECONDS, чтобы он сразу
+    видел свои изменения. Без реплик middleware не подключается."""
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            pin_to_primary(request)
+            return response
+        if is_pinned(request):
+            return self.get_response(request)
+        token = current_replica.set(replica_selector.choose())
+        try:
+            return self.get_response(request)
+        finally:
+            current_replica.reset(token)
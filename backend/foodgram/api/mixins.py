@@ -2,6 +2,12 @@
 from rest_framework.response import Response
 from rest_framework import status
 
+from api.cache import get_or_build, make_key
+from api.catalog import catalog_cache
+from foodgram.cache import (CATALOG_VERSION_KEY, LIST_VERSION_KEY,
+                            RECIPE_VERSION_KEY, get_version)
+from foodgram.db import primary
+
 
 class CreateDeleteModelMixin:
     """Миксин с методами создания и удаления объектов."""
@@ -18,3 +24,49 @@ class CreateDeleteModelMixin:
         obj = get_object_or_404(model_name, **kwargs)
         obj.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class AnonymousCacheMixin:
+    """Миксин кэширования list и retrieve для анонимных пользователей.
+
+    Ключ включает адрес запроса с параметрами фильтрации и пагинации и
+    версии, которые увеличиваются сигналами при изменении рецептов."""
+    def list(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        key = make_key('list', request, get_version(LIST_VERSION_KEY))
+
+        def build():
+            with primary():
+                return super(AnonymousCacheMixin, self).list(
+                    request, *args, **kwargs).data
+        return Response(get_or_build(key, build))
+
+    def retrieve(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().retrieve(request, *args, **kwargs)
+        key = make_key(
+            'detail', request, get_version(CATALOG_VERSION_KEY),
+            get_version(RECIPE_VERSION_KEY.format(kwargs[self.lookup_field]))
+        )
+
+        def build():
+            with primary():
+                return super(AnonymousCacheMixin, self).retrieve(
+                    request, *args, **kwargs).data
+        return Response(get_or_build(key, build))
+
+
+class CatalogMixin:
+    """Миксин отдачи полного справочника готовым телом ответа.
+
+    Список без параметров собирается один раз на версию каталога,
+    сжимается в gzip и brotli и отдаётся с сильным ETag, поэтому
+    повторный запрос клиента получает 304."""
+    def list(self, request, *args, **kwargs):
+        if request.query_params or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        return catalog_cache.response(
+            request, self.basename, lambda: request.accepted_renderer.render(
+                super(CatalogMixin, self).list(
+                    request, *args, **kwargs).data))
@@ -1,5 +1,204 @@
-﻿from rest_framework.pagination import PageNumberPagination
+﻿import json
+import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from heapq import merge
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import BigIntegerField, IntegerField, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, PageNumberPagination,
+                                       _positive_int)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по ключу (курсору) вместо OFFSET.
+
+    Порядок задаётся атрибутом cursor_ordering у view, по умолчанию
+    ('-pub_date', '-id'). Курсор хранит значения полей порядка последнего
+    объекта страницы, следующая страница выбирается условием
+    (pub_date, id) < (курсор) по составному индексу."""
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    page_size_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    default_ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = getattr(view, 'cursor_ordering',
+                                self.default_ordering)
+        self.count = self.get_count(queryset, request)
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                queryset = queryset.filter(
+                    self.get_cursor_filter(cursor, queryset.model))
+            except (ValidationError, ValueError, TypeError, OverflowError):
+                raise NotFound(self.invalid_cursor_message)
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param, 'exact')
+        if mode == 'none':
+            return None
+        if mode == 'approximate':
+            return get_approximate_count(queryset)
+        return queryset.count()
+
+    @staticmethod
+    def clean_cursor_value(model, name, value):
+        """Значение курсора, проверенное и приведённое к типу поля
+        порядка: целые поля принимают только конечные целые числа,
+        в пределах bigint, остальные — строки"""
+        field = model._meta.get_field(name)
+        if field.is_relation:
+            field = field.target_field
+        expected = int if isinstance(field, IntegerField) else str
+        if (not isinstance(value, expected) or isinstance(value, bool)
+                or isinstance(value, float) and not math.isfinite(value)
+                or expected is int
+                and abs(value) > BigIntegerField.MAX_BIGINT):
+            raise ValidationError('Неверный тип значения курсора')
+        return field.to_python(value)
+
+    def get_cursor_filter(self, cursor, model):
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode()))
+        except (DecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(values, list)
+                or len(values) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            value = self.clean_cursor_value(model, name, value)
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def encode_cursor(self, obj):
+        values = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat')
+                          else value)
+        return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
+
+
+class FeedPagination(KeysetPagination):
+    """Пагинация ленты по ключу поверх нескольких источников.
+
+    Источник — пара (queryset, порядок) с полями порядка, равными
+    (pub_date, id рецепта). Из каждого выбирается не больше страницы
+    после курсора, выборки сливаются, а рецепты страницы загружаются
+    одним запросом. Общее число записей не считается."""
+
+    def paginate_queryset(self, sources, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        cursor = request.query_params.get(self.cursor_query_param)
+        keys = []
+        for queryset, ordering in sources:
+            self.ordering = ordering
+            if cursor:
+                try:
+                    queryset = queryset.filter(
+                        self.get_cursor_filter(cursor, queryset.model))
+                except (ValidationError, ValueError, TypeError,
+                        OverflowError):
+                    raise NotFound(self.invalid_cursor_message)
+            keys.append(queryset.order_by(*ordering).values_list(
+                *(field.lstrip('-') for field in ordering)
+            )[:self.page_size + 1])
+        page = list(islice(merge(*keys, reverse=True), self.page_size + 1))
+        self.has_next = len(page) > self.page_size
+        recipe_ids = [recipe_id for _, recipe_id in page[:self.page_size]]
+        recipes = view.get_queryset().in_bulk(recipe_ids)
+        self.ordering = self.default_ordering
+        self.page = [recipes[recipe_id] for recipe_id in recipe_ids
+                     if recipe_id in recipes]
+        return self.page
+
+
+def get_approximate_count(queryset):
+    """Оценка числа строк по плану запроса PostgreSQL без COUNT(*)"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class RankedPagination(PageNumberPagination):
+    """Постраничная пагинация списка id рецептов, уже упорядоченного
+    по релевантности; рецепты страницы загружаются одним запросом"""
+    page_size_query_param = 'limit'
+
+    def paginate_queryset(self, recipe_ids, request, view=None):
+        page_ids = super().paginate_queryset(recipe_ids, request, view)
+        recipes = view.get_queryset().in_bulk(page_ids)
+        return [recipes[recipe_id] for recipe_id in page_ids
+                if recipe_id in recipes]
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная пагинация; с ?pagination=cursor — пагинация по ключу"""
     page_size_query_param = 'limit'
+    mode_query_param = 'pagination'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if request.query_params.get(self.mode_query_param) == 'cursor':
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,63 @@
+from api.benchmark import SCENARIOS, Fixtures, run
+
+# Наибольшее допустимое число SQL-запросов на один HTTP-запрос.
+# Число не должно зависеть ни от размера страницы, ни от количества
+# подписок, рецептов и ингредиентов в базе
+QUERY_BUDGETS = {
+    'TagsViewSet.list': 1,
+    'TagsViewSet.retrieve': 1,
+    'IngredientViewSet.list': 1,
+    'IngredientViewSet.retrieve': 1,
+    'RecipeViewSet.list': 7,
+    'RecipeViewSet.list limit=50': 7,
+    'RecipeViewSet.list anonymous': 7,
+    'RecipeViewSet.list is_favorited': 7,
+    'RecipeViewSet.list tags': 8,
+    'RecipeViewSet.retrieve': 6,
+    'RecipeViewSet.feed': 7,
+    'RecipeViewSet.pantry': 6,
+    'RecipeViewSet.similar': 7,
+    'RecipeViewSet.create': 12,
+    'RecipeViewSet.partial_update': 5,
+    'RecipeViewSet.destroy': 17,
+    'RecipeViewSet.favorite': 4,
+    'RecipeViewSet.favorite delete': 3,
+    'RecipeViewSet.shopping_cart': 11,
+    'RecipeViewSet.shopping_cart delete': 10,
+    'RecipeViewSet.download_shopping_cart': 1,
+    'SubcsribeView.list': 3,
+    'SubcsribeView.create': 5,
+    'SubcsribeView.retrieve': 2,
+    'SubcsribeView.me': 1,
+    'SubcsribeView.subscriptions': 4,
+    'SubcsribeView.subscriptions recipes_limit=3': 4,
+    'SubcsribeView.subscribe': 8,
+    'SubcsribeView.subscribe delete': 4,
+    'api-root': 0,
+}
+
+
+def count_queries(scenarios=SCENARIOS):
+    """Число запросов к БД для каждого сценария на текущих данных"""
+    fixtures = Fixtures()
+    return {scenario.name: run(scenario, fixtures, 1)['queries']
+            for scenario in scenarios}
+
+
+def check(measurements, budgets=QUERY_BUDGETS):
+    """Сравнивает замеры на нескольких наборах данных с бюджетами.
+
+    measurements — список словарей сценарий → число запросов от
+    меньшего набора данных к большему. Возвращает список нарушений."""
+    errors = []
+    for name in measurements[0]:
+        counts = [measurement[name] for measurement in measurements]
+        budget = budgets.get(name)
+        if budget is None:
+            errors.append(f'{name}: бюджет не задан, запросов {counts}')
+        elif max(counts) > budget:
+            errors.append(f'{name}: запросов {counts}, бюджет {budget}')
+        if counts[-1] > counts[0]:
+            errors.append(f'{name}: число запросов растёт с объёмом '
+                          f'данных: {counts}')
+    return errors
@@ -0,0 +1,132 @@
+import csv
+import json
+from io import BytesIO
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer
+
+SHOPPING_CART_TITLE = 'Список покупок:'
+
+
+class ShoppingCartRenderer(BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    Строки списка — кортежи (название, единица измерения, количество).
+    Метод stream отдаёт файл по частям для StreamingHttpResponse."""
+    charset = 'utf-8'
+    extension = None
+
+    def stream(self, rows):
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # Ответ с ошибкой, например неизвестный формат или 401
+            return json.dumps(data, ensure_ascii=False).encode()
+        return b''.join(
+            chunk if isinstance(chunk, bytes) else chunk.encode(self.charset)
+            for chunk in self.stream(data)
+        )
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    """Список покупок в виде текстового файла"""
+    media_type = 'text/plain'
+    format = 'txt'
+    extension = 'txt'
+
+    def stream(self, rows):
+        yield SHOPPING_CART_TITLE
+        for name, measurement_unit, amount in rows:
+            yield f'\n{name} - {amount}, {measurement_unit}'
+
+
+class Echo:
+    """Псевдобуфер: csv.writer пишет в него, а строка сразу отдаётся"""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    """Список покупок в формате CSV"""
+    media_type = 'text/csv'
+    format = 'csv'
+    extension = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('Ингредиент', 'Количество',
+                               'Единица измерения'))
+        for name, measurement_unit, amount in rows:
+            yield writer.writerow((name, amount, measurement_unit))
+
+
+class ShoppingCartJSONRenderer(ShoppingCartRenderer):
+    """Список покупок в формате JSON"""
+    media_type = 'application/json'
+    format = 'json'
+    extension = 'json'
+
+    def stream(self, rows):
+        separator = '['
+        for name, measurement_unit, amount in rows:
+            yield separator + json.dumps(
+                {'name': name, 'measurement_unit': measurement_unit,
+                 'amount': amount},
+                ensure_ascii=False
+            )
+            separator = ','
+        yield ']' if separator == ',' else '[]'
+
+
+class ShoppingCartPDFRenderer(ShoppingCartRenderer):
+    """Список покупок в формате PDF.
+
+    reportlab не умеет писать документ потоково, поэтому PDF собирается
+    в памяти и затем отдаётся частями."""
+    media_type = 'application/pdf'
+    format = 'pdf'
+    extension = 'pdf'
+    charset = None
+    font_name = 'ShoppingCartFont'
+    font_size = 12
+    margin = 50
+    chunk_size = 64 * 1024
+
+    def stream(self, rows):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_CART_PDF_FONT))
+        buffer = BytesIO()
+        page = canvas.Canvas(buffer, pagesize=A4)
+        _, height = A4
+        line_height = self.font_size * 1.5
+        page.setFont(self.font_name, self.font_size)
+        page.drawString(self.margin, height - self.margin,
+                        SHOPPING_CART_TITLE)
+        y = height - self.margin - line_height * 2
+        for name, measurement_unit, amount in rows:
+            if y < self.margin:
+                page.showPage()
+                page.setFont(self.font_name, self.font_size)
+                y = height - self.margin
+            page.drawString(self.margin, y,
+                            f'{name} - {amount}, {measurement_unit}')
+            y -= line_height
+        page.save()
+        data = buffer.getbuffer()
+        for start in range(0, len(data), self.chunk_size):
+            yield bytes(data[start:start + self.chunk_size])
+
+
+SHOPPING_CART_RENDERERS = (
+    ShoppingCartTextRenderer,
+    ShoppingCartCSVRenderer,
+    ShoppingCartJSONRenderer,
+    ShoppingCartPDFRenderer,
+)
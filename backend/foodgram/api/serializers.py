@@ -1,5 +1,7 @@
-﻿from django.contrib.auth import get_user_model
+﻿from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models import Count
 # from django.shortcuts import get_object_or_404
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
@@ -7,21 +9,25 @@ from rest_framework import serializers
 from rest_framework.serializers import ValidationError
 from rest_framework.validators import UniqueTogetherValidator
 
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+from api.metrics import TimedSerializerMixin
+from api.viewer import get_viewer
+from recipes.models import (Favorite, FeedTask, ImageTask, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListItem,
+                            Tag)
 from users.models import Subscribe
 
 User = get_user_model()
 
 
-class TagsSerializer(serializers.ModelSerializer):
+class TagsSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для тэгов"""
     class Meta:
         model = Tag
         fields = ('id', 'name', 'color', 'slug')
 
 
-class IngredientsSerializer(serializers.ModelSerializer):
+class IngredientsSerializer(TimedSerializerMixin,
+                            serializers.ModelSerializer):
     """Сериализатор для ингредиентов"""
     class Meta:
         model = Ingredient
@@ -36,7 +42,7 @@ class UserRegistrationSerializer(UserCreateSerializer):
                   'last_name', 'password', 'id')
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedSerializerMixin, UserSerializer):
     """Сериализатор для информации о пользователях"""
     is_subscribed = serializers.SerializerMethodField()
 
@@ -47,18 +53,18 @@ class CustomUserSerializer(UserSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
-        if request.user.is_authenticated:
-            return obj.following.filter(
-                user=request.user, following=obj
-            ).exists()
-        return False
+        if request is None:
+            return False
+        return obj.id in get_viewer(request).following_ids
 
 
-class RecipeinfoSerializer(serializers.ModelSerializer):
+class RecipeinfoSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     """Сериализатор о краткой информации рецепта"""
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'thumbnail', 'image_webp',
+                  'cooking_time')
 
 
 class RecipeIngredientSerializer(serializers.ModelSerializer):
@@ -85,7 +91,8 @@ class RecipeIngredientAmountSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeFullSerializer(serializers.ModelSerializer):
+class RecipeFullSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     """Сериализатор о полной информации рецепта"""
     tags = TagsSerializer(many=True, read_only=True)
     author = CustomUserSerializer(read_only=True)
@@ -96,25 +103,24 @@ class RecipeFullSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'name',
-                  'image', 'text', 'cooking_time', 'is_favorited',
-                  'is_in_shopping_cart')
+                  'image', 'thumbnail', 'image_webp', 'text', 'cooking_time',
+                  'is_favorited', 'is_in_shopping_cart')
 
     def get_ingredients(self, obj):
-        ingredients = (obj.recipeingredients.filter(recipe=obj))
+        ingredients = obj.recipeingredients.all()
         return RecipeIngredientSerializer(ingredients, many=True).data
 
     def get_is_favorited(self, obj):
         request = self.context.get('request')
-        if request.user.is_authenticated:
-            return obj.favorites.filter(recipe=obj, user=request.user).exists()
-        return False
+        if request is None:
+            return False
+        return obj.id in get_viewer(request).favorite_ids
 
     def get_is_in_shopping_cart(self, obj):
         request = self.context.get('request')
-        if request.user.is_authenticated:
-            return obj.shoppingcarts.filter(recipe=obj,
-                                            user=request.user).exists()
-        return False
+        if request is None:
+            return False
+        return obj.id in get_viewer(request).shopping_cart_ids
 
 
 class RecipeAddSerializer(serializers.ModelSerializer):
@@ -141,6 +147,12 @@ class RecipeAddSerializer(serializers.ModelSerializer):
             unique_ingredients.add(ingredient.get('id'))
         if len(ingredients) > len(unique_ingredients):
             raise ValidationError('Ингредиенты не должны повторяться')
+        missing = unique_ingredients - set(
+            Ingredient.objects.in_bulk(unique_ingredients))
+        if missing:
+            raise ValidationError(
+                'Ингредиенты не найдены: '
+                f'{", ".join(map(str, sorted(missing)))}')
         return ingredients
 
     def validate_tags(self, tags):
@@ -154,15 +166,43 @@ class RecipeAddSerializer(serializers.ModelSerializer):
         return tags
 
     def add_recipe_ingredients(self, ingredients, recipe):
-        recipe_ingredients = []
-        for ingredient in ingredients:
-            ingredient_obj = Ingredient.objects.get(id=ingredient['id'])
-            amount = ingredient['amount']
-            recipe_ingredients.append(
-                RecipeIngredient(recipe=recipe, ingredient=ingredient_obj,
-                                 amount=amount)
-            )
-        RecipeIngredient.objects.bulk_create(recipe_ingredients)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient_id=ingredient['id'],
+                             amount=ingredient['amount'])
+            for ingredient in ingredients
+        )
+
+    def update_recipe_ingredients(self, ingredients, recipe):
+        """Изменяет только те строки состава, которые поменялись.
+        Возвращает True, если изменился набор ингредиентов"""
+        existing = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in recipe.recipeingredients.all()
+        }
+        old_amounts = {ingredient_id: recipe_ingredient.amount
+                       for ingredient_id, recipe_ingredient
+                       in existing.items()}
+        new_amounts = {ingredient['id']: ingredient['amount']
+                       for ingredient in ingredients}
+        to_create, to_update = [], []
+        for ingredient_id, amount in new_amounts.items():
+            recipe_ingredient = existing.get(ingredient_id)
+            if recipe_ingredient is None:
+                to_create.append(RecipeIngredient(
+                    recipe=recipe, ingredient_id=ingredient_id,
+                    amount=amount))
+            elif recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                to_update.append(recipe_ingredient)
+        to_delete = [recipe_ingredient.id for ingredient_id, recipe_ingredient
+                     in existing.items() if ingredient_id not in new_amounts]
+        if to_delete:
+            RecipeIngredient.objects.filter(id__in=to_delete).delete()
+        RecipeIngredient.objects.bulk_update(to_update, ('amount', ))
+        RecipeIngredient.objects.bulk_create(to_create)
+        ShoppingListItem.objects.change_recipe(recipe, old_amounts,
+                                               new_amounts)
+        return bool(to_create or to_delete)
 
     @transaction.atomic
     def create(self, validated_data):
@@ -170,6 +210,8 @@ class RecipeAddSerializer(serializers.ModelSerializer):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(author=author, **validated_data)
+        ImageTask.objects.create(recipe=recipe)
+        FeedTask.objects.create(recipe=recipe)
         self.add_recipe_ingredients(ingredients, recipe)
         recipe.tags.set(tags)
         return recipe
@@ -178,11 +220,30 @@ class RecipeAddSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients', None)
         tags = validated_data.pop('tags', None)
-        instance.ingredients.clear()
-        self.add_recipe_ingredients(ingredients, instance)
-        instance.tags.set(tags)
+        if (ingredients is not None
+                and self.update_recipe_ingredients(ingredients, instance)):
+            instance.similar_stale = True
+        if tags is not None and {tag.id for tag in tags} != set(
+                instance.tags.values_list('id', flat=True)):
+            instance.tags.set(tags)
+            instance.similar_stale = True
+        image = validated_data.get('image')
+        if image is not None and self.is_same_image(instance, image):
+            # Клиент повторно прислал ту же картинку
+            validated_data.pop('image')
+        elif image is not None:
+            # Копии старого изображения устарели, до обработки новой
+            # картинки клиенты получат оригинал
+            instance.thumbnail = instance.image_webp = ''
+            ImageTask.objects.create(recipe=instance)
         return super().update(instance, validated_data)
 
+    @staticmethod
+    def is_same_image(recipe, image):
+        field = recipe.image.field
+        name = field.generate_filename(recipe, image.name)
+        return field.storage.get_content_name(name, image) == recipe.image.name
+
     def to_representation(self, recipe):
         data = RecipeinfoSerializer(
             recipe, context=self.context).data
@@ -210,12 +271,22 @@ class FavouriteSerializer(FavoriteAndShoppingCartSerializer):
         model = Favorite
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(FavoriteAndShoppingCartSerializer):
     """Сериализатор для списка покупок"""
     class Meta(FavoriteAndShoppingCartSerializer.Meta):
         model = ShoppingCart
 
 
+class PantrySerializer(serializers.Serializer):
+    """Параметры поиска рецептов по имеющимся ингредиентам"""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.PANTRY_MAX_INGREDIENTS
+    )
+    missing = serializers.IntegerField(min_value=0, default=0)
+
+
 class SubscriptionsSerializer(CustomUserSerializer):
     """Сериализатор о подписках пользователя"""
     recipes = serializers.SerializerMethodField()
@@ -229,22 +300,51 @@ class SubscriptionsSerializer(CustomUserSerializer):
         read_only_fields = ('email', 'username', 'first_name', 'last_name',
                             'is_subscribed', 'recipes', 'recipes_count')
 
+    @staticmethod
+    def get_recipes_limit(request):
+        recipes_limit = request.query_params.get('recipes_limit')
+        if recipes_limit and recipes_limit.isdigit():
+            return int(recipes_limit)
+        return None
+
+    @staticmethod
+    def annotate_authors(queryset):
+        """Число рецептов для списка подписок"""
+        return queryset.annotate(
+            recipes_count=Count('recipes')
+        ).order_by(*User._meta.ordering)
+
+    @classmethod
+    def prefetch_recipes(cls, authors, request):
+        """Подгружает последние рецепты всех авторов одним запросом"""
+        recipes = Recipe.objects.latest_for_authors(
+            [author.id for author in authors],
+            cls.get_recipes_limit(request)
+        )
+        for author in authors:
+            author.latest_recipes = recipes.get(author.id, [])
+        return authors
+
     def get_recipes(self, obj):
         request = self.context.get('request')
-        recipes_limit = None
-        if request:
-            recipes_limit = request.query_params.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if recipes_limit:
-            recipes = obj.recipes.all()[:int(recipes_limit)]
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
+        else:
+            recipes = obj.recipes.all()
+            recipes_limit = self.get_recipes_limit(request)
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
         return RecipeinfoSerializer(recipes, many=True,
                                     context={'request': request}).data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
 
 
-class SubscribeSerializer(serializers.ModelSerializer):
+class SubscribeSerializer(TimedSerializerMixin,
+                          serializers.ModelSerializer):
     """Сериализатор для редактирования подписок пользователя"""
     class Meta:
         model = Subscribe
@@ -267,6 +367,9 @@ class SubscribeSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         request = self.context.get('request')
+        following = SubscriptionsSerializer.annotate_authors(
+            User.objects.filter(id=instance.following_id)).get()
+        SubscriptionsSerializer.prefetch_recipes([following], request)
         return SubscriptionsSerializer(
-            instance.following, context={'request': request}
+            following, context={'request': request}
         ).data
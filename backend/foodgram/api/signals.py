@@ -0,0 +1,95 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import token_cache
+from foodgram.cache import (bump_catalog, bump_recipe, bump_recipes,
+                            bump_shopping_lists)
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+
+User = get_user_model()
+
+# Поля автора, которые попадают в закэшированные ответы с рецептами
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipe(instance, **kwargs):
+    transaction.on_commit(lambda: bump_recipe(instance.id))
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def invalidate_recipe_ingredient(instance, **kwargs):
+    transaction.on_commit(lambda: bump_recipe(instance.recipe_id))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        transaction.on_commit(lambda: bump_recipe(instance.id))
+    else:
+        transaction.on_commit(bump_catalog)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_catalog(**kwargs):
+    transaction.on_commit(bump_catalog)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_shopping_lists(**kwargs):
+    """Название и единица измерения попадают в выгрузку списка покупок"""
+    transaction.on_commit(bump_shopping_lists)
+
+
+@receiver(post_delete, sender=Token)
+def revoke_deleted_token(instance, **kwargs):
+    keys = (instance.key, )
+    transaction.on_commit(lambda: token_cache.revoke(keys))
+
+
+@receiver(user_logged_out)
+def revoke_logged_out_user(user, **kwargs):
+    if user is not None:
+        user_id = user.id
+        transaction.on_commit(lambda: token_cache.revoke_user(user_id))
+
+
+@receiver(post_save, sender=User)
+def revoke_changed_user(instance, update_fields, **kwargs):
+    """Смена пароля, деактивация и другие правки профиля сбрасывают
+    кэш токенов; обновление last_login при входе — нет"""
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    user_id = instance.id
+    transaction.on_commit(lambda: token_cache.revoke_user(user_id))
+
+
+@receiver(pre_save, sender=User)
+def check_author_fields(instance, update_fields, **kwargs):
+    fields = [field for field in AUTHOR_FIELDS
+              if update_fields is None or field in update_fields]
+    instance._author_changed = False
+    if instance.pk is None or not fields:
+        return
+    old = User.objects.filter(pk=instance.pk).values_list(*fields).first()
+    instance._author_changed = old is not None and old != tuple(
+        getattr(instance, field) for field in fields)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_recipes(instance, **kwargs):
+    """Переименование автора меняет закэшированные для анонимов списки
+    и страницы его рецептов"""
+    if getattr(instance, '_author_changed', False):
+        author_id = instance.id
+        transaction.on_commit(lambda: bump_recipes(
+            Recipe.objects.filter(author_id=author_id).values_list(
+                'id', flat=True).iterator()))
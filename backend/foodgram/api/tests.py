@@ -0,0 +1,290 @@
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from api.authentication import CachedTokenAuthentication, token_cache
+from api.benchmark import Fixtures
+from api.querybudget import check, count_queries
+from recipes.admin import RecipeIngredientAdmin
+from recipes.feed import POPULAR_AUTHORS_KEY, fan_out, popular_author_ids
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeQuerySet, ShoppingCart, ShoppingListItem,
+                            TimelineEntry)
+from recipes.pantry import Bitsets, PantryIndex, load_pairs
+from users.models import Subscribe
+
+MEDIA_ROOT = tempfile.mkdtemp()
+LOCMEM_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': alias}
+    for alias in ('default', 'versions')
+}
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    CACHES=LOCMEM_CACHES,
+)
+class QueryBudgetTest(TestCase):
+    """Число запросов к БД на каждом эндпоинте укладывается в бюджет
+    из api/querybudget.py и не растёт вместе с объёмом данных.
+
+    Замеры идут на двух наборах данных; у пользователя, от имени
+    которого выполняются сценарии, на обоих есть избранное, корзина и
+    подписки, чтобы флаги и вложенные списки в ответах были непустыми."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def seed(self, users, recipes, per_user, seed):
+        call_command('generatedata', users=users, recipes=recipes,
+                     subscriptions=per_user, favorites=per_user,
+                     cart=per_user, seed=seed, stdout=StringIO())
+        viewer = Fixtures().user
+        recipe_ids = Recipe.objects.exclude(author=viewer).order_by(
+            '-id').values_list('id', flat=True)[:per_user]
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                (model(user=viewer, recipe_id=recipe_id)
+                 for recipe_id in recipe_ids), ignore_conflicts=True)
+        Subscribe.objects.bulk_create(
+            (Subscribe(user=viewer, following_id=author_id)
+             for author_id in Recipe.objects.exclude(author=viewer)
+             .order_by('-id').values_list('author_id', flat=True)
+             .distinct()[:per_user]),
+            ignore_conflicts=True)
+        call_command('rebuildshoppinglists', stdout=StringIO())
+        call_command('fanout', rebuild=True, stdout=StringIO())
+
+    def test_query_budgets(self):
+        self.seed(users=10, recipes=40, per_user=3, seed=1)
+        measurements = [count_queries()]
+        self.seed(users=90, recipes=360, per_user=30, seed=2)
+        measurements.append(count_queries())
+        errors = check(measurements)
+        self.assertFalse(errors, 'Превышен бюджет запросов:\n'
+                         + '\n'.join(errors))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ShoppingListSyncTest(TestCase):
+    """Списки покупок совпадают с корзинами после правок в обход API:
+    каскадных удалений, правок корзины и состава рецепта в админке"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generatedata', users=6, recipes=20, subscriptions=2,
+                     favorites=2, cart=4, seed=3, stdout=StringIO())
+        call_command('rebuildshoppinglists', stdout=StringIO())
+
+    def assertInSync(self):
+        self.assertEqual(
+            ShoppingListItem.objects.ground_truth(),
+            dict(((user_id, ingredient_id), amount)
+                 for user_id, ingredient_id, amount
+                 in ShoppingListItem.objects.values_list(
+                     'user_id', 'ingredient_id', 'total_amount')))
+
+    def test_cascades(self):
+        ShoppingCart.objects.first().recipe.delete()
+        self.assertInSync()
+        ShoppingCart.objects.last().recipe.author.delete()
+        self.assertInSync()
+
+    def test_shopping_cart_edit(self):
+        cart = ShoppingCart.objects.first()
+        cart.recipe = Recipe.objects.exclude(
+            shoppingcarts__user=cart.user).first()
+        cart.save()
+        self.assertInSync()
+
+    def test_recipe_ingredient_admin(self):
+        admin = RecipeIngredientAdmin(RecipeIngredient, None)
+        row = RecipeIngredient.objects.filter(
+            recipe__shoppingcarts__isnull=False).first()
+        row.amount += 5
+        admin.save_model(None, row, None, change=True)
+        self.assertInSync()
+        admin.delete_queryset(None, RecipeIngredient.objects.filter(
+            recipe=row.recipe))
+        self.assertInSync()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=LOCMEM_CACHES,
+                   PANTRY_INDEX_CHECK_INTERVAL=0,
+                   LOCAL_CACHE_UNSHARED_MAX_AGE=60)
+class PantryIndexTest(TestCase):
+    """Индекс применяет изменения составов по рецептам без полной
+    пересборки и совпадает с собранным заново"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generatedata', users=4, recipes=30, subscriptions=1,
+                     favorites=1, cart=1, seed=4, stdout=StringIO())
+
+    def test_incremental_update(self):
+        ingredient_ids = list(Ingredient.objects.filter(
+            recipeingredients__isnull=False).values_list(
+            'id', flat=True).distinct()[:40])
+        index = PantryIndex()
+        index.search(ingredient_ids, 2)
+        built_at = index._copy._built_at
+        with self.captureOnCommitCallbacks(execute=True):
+            first, second, third = Recipe.objects.all()[:3]
+            first.delete()
+            second.recipeingredients.first().delete()
+            ingredient = Ingredient.objects.create(
+                name='Новый', measurement_unit='г')
+            ingredient_ids.append(ingredient.id)
+            RecipeIngredient.objects.create(
+                recipe=third, ingredient=ingredient, amount=1)
+        for missing in range(3):
+            self.assertEqual(
+                index.search(ingredient_ids, missing),
+                Bitsets(load_pairs()).search(ingredient_ids, missing))
+        self.assertEqual(index._copy._built_at, built_at)
+
+    def test_changes_under_one_version(self):
+        """Списки изменений, получившие одну версию при неатомарном
+        incr, не затирают друг друга"""
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        index = PantryIndex()
+        index.search(ingredient_ids, 2)
+        built_at = index._copy._built_at
+        first, second = Recipe.objects.all()[:2]
+        RecipeIngredient.objects.filter(recipe__in=(first, second)).delete()
+        version = index.invalidate((first.id, ))
+        with mock.patch('foodgram.cache.bump_version', return_value=version):
+            index.invalidate((second.id, ))
+        self.assertEqual(index.search(ingredient_ids, 2),
+                         Bitsets(load_pairs()).search(ingredient_ids, 2))
+        self.assertEqual(index._copy._built_at, built_at)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class SearchVectorTest(TestCase):
+    """Поисковые векторы пересчитываются после правок в обход
+    сериализатора: переименования ингредиента и правки состава"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generatedata', users=3, recipes=10, subscriptions=1,
+                     favorites=1, cart=1, seed=6, stdout=StringIO())
+
+    def refreshed(self, change):
+        with mock.patch.object(RecipeQuerySet, 'update_search_vectors',
+                               autospec=True) as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+        return {recipe_id for call in update.call_args_list
+                for recipe_id in call.args[0].values_list('id', flat=True)}
+
+    def test_ingredient_rename(self):
+        ingredient = Ingredient.objects.filter(
+            recipeingredients__isnull=False).first()
+        ingredient.name = 'Переименован'
+        self.assertEqual(
+            self.refreshed(ingredient.save),
+            set(Recipe.objects.filter(
+                recipeingredients__ingredient=ingredient).values_list(
+                'id', flat=True)))
+
+    def test_recipe_ingredient_admin(self):
+        row = RecipeIngredient.objects.first()
+        admin = RecipeIngredientAdmin(RecipeIngredient, None)
+        self.assertEqual(self.refreshed(
+            lambda: admin.save_model(None, row, None, change=True)),
+            {row.recipe_id})
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=LOCMEM_CACHES)
+class FeedFanoutTest(TestCase):
+    """Рецепты, опубликованные, пока автор был популярным, попадают в
+    ленты подписчиков, когда он выбывает из популярных"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generatedata', users=4, recipes=8, subscriptions=2,
+                     favorites=1, cart=1, seed=7, stdout=StringIO())
+
+    def test_author_leaves_popular(self):
+        subscription = Subscribe.objects.first()
+        recipe = Recipe.objects.filter(
+            author_id=subscription.following_id).first()
+        TimelineEntry.objects.filter(recipe=recipe).delete()
+        caches['default'].delete(POPULAR_AUTHORS_KEY)
+        with self.settings(FEED_FANOUT_MAX_FOLLOWERS=0):
+            self.assertEqual(fan_out(recipe), 0)
+        caches['default'].delete(POPULAR_AUTHORS_KEY)
+        self.assertNotIn(subscription.following_id, popular_author_ids())
+        call_command('fanout', once=True, stdout=StringIO())
+        self.assertTrue(TimelineEntry.objects.filter(
+            user_id=subscription.user_id, recipe=recipe).exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TokenCacheTest(TestCase):
+    """Отозванный токен перестаёт приниматься, даже если отзыв
+    закоммичен между чтением токена из БД и записью в кэш"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            username='reader', email='reader@example.com', password='x')
+        self.key = Token.objects.create(user=user).key
+        self.authentication = CachedTokenAuthentication()
+
+    def test_deleted_token(self):
+        self.authentication.authenticate_credentials(self.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.filter(key=self.key).delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.key)
+
+    def test_revoked_during_lookup(self):
+        lookup = TokenAuthentication.authenticate_credentials
+
+        def lookup_then_revoke(authentication, key):
+            result = lookup(authentication, key)
+            token_cache.revoke((key, ))
+            return result
+        with mock.patch.object(TokenAuthentication,
+                               'authenticate_credentials',
+                               lookup_then_revoke):
+            self.authentication.authenticate_credentials(self.key)
+        self.assertIsNone(token_cache.get(self.key))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=LOCMEM_CACHES)
+class AuthorCacheTest(TestCase):
+    """Закэшированные для анонимов ответы показывают новое имя автора"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generatedata', users=3, recipes=5, subscriptions=1,
+                     favorites=1, cart=1, seed=5, stdout=StringIO())
+
+    def test_renamed_author(self):
+        client = APIClient()
+        recipe = Recipe.objects.first()
+        urls = ('/api/recipes/', f'/api/recipes/{recipe.id}/')
+        for url in urls:
+            client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.author.first_name = 'Переименован'
+            recipe.author.save()
+        self.assertIn('Переименован', client.get(urls[0]).content.decode())
+        self.assertEqual(
+            client.get(urls[1]).json()['author']['first_name'],
+            'Переименован')
@@ -5,7 +5,7 @@ from rest_framework.routers import DefaultRouter
 
 
 from api.views import (IngredientViewSet, RecipeViewSet, SubcsribeView,
-                       TagsViewSet)
+                       TagsViewSet, export_metrics, serve_media)
 
 router = DefaultRouter()
 router.register('tags', TagsViewSet, basename='tags')
@@ -14,11 +14,12 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('users', SubcsribeView, basename='users')
 
 urlpatterns = [
+    path('metrics/', export_metrics, name='metrics'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL,
+    urlpatterns += static(settings.MEDIA_URL, view=serve_media,
                           document_root=settings.MEDIA_ROOT)
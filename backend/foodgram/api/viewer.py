@@ -0,0 +1,42 @@
+from django.utils.functional import cached_property
+
+from recipes.models import Favorite, ShoppingCart
+from users.models import Subscribe
+
+
+class Viewer:
+    """Избранное, корзина и подписки текущего пользователя.
+
+    Каждое множество id загружается одним запросом при первом обращении
+    и живёт до конца запроса, поэтому сериализаторы проверяют флаги
+    без запросов на каждый объект."""
+
+    def __init__(self, user):
+        self.user = user
+
+    def _ids(self, queryset, field):
+        if not self.user.is_authenticated:
+            return frozenset()
+        return frozenset(queryset.filter(user=self.user).values_list(
+            field, flat=True))
+
+    @cached_property
+    def favorite_ids(self):
+        return self._ids(Favorite.objects, 'recipe_id')
+
+    @cached_property
+    def shopping_cart_ids(self):
+        return self._ids(ShoppingCart.objects, 'recipe_id')
+
+    @cached_property
+    def following_ids(self):
+        return self._ids(Subscribe.objects, 'following_id')
+
+
+def get_viewer(request):
+    """Контекст текущего пользователя, общий для всего запроса"""
+    http_request = getattr(request, '_request', request)
+    viewer = getattr(http_request, 'viewer', None)
+    if viewer is None or viewer.user != request.user:
+        viewer = http_request.viewer = Viewer(request.user)
+    return viewer
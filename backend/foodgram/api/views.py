@@ -1,29 +1,63 @@
+from hashlib import md5
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.static import serve
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
+from prometheus_client import CONTENT_TYPE_LATEST
 from rest_framework import filters, viewsets
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import AllowAny, IsAuthenticated, SAFE_METHODS
+from rest_framework.response import Response
 
 from api.filters import IngredientFilter, RecipeFilter
-from api.mixins import CreateDeleteModelMixin
-from api.pagination import CustomPagination
+from api.metrics import export
+from api.mixins import (AnonymousCacheMixin, CatalogMixin,
+                        CreateDeleteModelMixin)
+from api.pagination import (CustomPagination, FeedPagination,
+                            RankedPagination)
 from api.permissions import IsAdminAuthorOrReadOnly
+from api.renderers import SHOPPING_CART_RENDERERS
 from api.serializers import (FavouriteSerializer, IngredientsSerializer,
-                             RecipeAddSerializer, RecipeFullSerializer,
-                             ShoppingCartSerializer, SubscribeSerializer,
-                             SubscriptionsSerializer, TagsSerializer)
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+                             PantrySerializer, RecipeAddSerializer,
+                             RecipeFullSerializer, ShoppingCartSerializer,
+                             SubscribeSerializer, SubscriptionsSerializer,
+                             TagsSerializer)
+from foodgram.cache import shopping_list_versions
+from recipes.autocomplete import ingredient_index
+from recipes.feed import feed_sources
+from recipes.pantry import pantry_index
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
 from users.models import Subscribe
 
 User = get_user_model()
 
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+def serve_media(request, path, document_root=None):
+    """Отдаёт медиафайлы в режиме отладки. Имена изображений
+    рецептов — хэши содержимого, поэтому файлы кэшируются навсегда"""
+    response = serve(request, path, document_root)
+    patch_cache_control(response, public=True, immutable=True,
+                        max_age=settings.MEDIA_CACHE_MAX_AGE)
+    return response
+
+
+def export_metrics(request):
+    """Метрики запросов в формате Prometheus. Доступны только при
+    включённом REQUEST_METRICS_ENABLED"""
+    if not settings.REQUEST_METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(export(), content_type=CONTENT_TYPE_LATEST)
+
+
+class TagsViewSet(CatalogMixin, viewsets.ReadOnlyModelViewSet):
     """Работа с информацией о тэгах"""
     queryset = Tag.objects.all()
     serializer_class = TagsSerializer
@@ -31,7 +65,7 @@ class TagsViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogMixin, viewsets.ReadOnlyModelViewSet):
     """Работа с информацией об ингредиентах"""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientsSerializer
@@ -41,8 +75,15 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     search_fields = ('name', )
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name is None or 'search' in request.query_params:
+            return super().list(request, *args, **kwargs)
+        return Response(ingredient_index.search(name))
+
 
-class RecipeViewSet(CreateDeleteModelMixin, viewsets.ModelViewSet):
+class RecipeViewSet(AnonymousCacheMixin, CreateDeleteModelMixin,
+                    viewsets.ModelViewSet):
     """Работа с рецептами. Редактирование рецептов.
     Добавление/удаление в/из избранное, список покупок.
     Скачивание списка покупок"""
@@ -52,11 +93,50 @@ class RecipeViewSet(CreateDeleteModelMixin, viewsets.ModelViewSet):
     filterset_class = RecipeFilter
     pagination_class = CustomPagination
 
+    def get_queryset(self):
+        if self.request.method not in SAFE_METHODS:
+            return super().get_queryset()
+        return Recipe.objects.with_related()
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeFullSerializer
         return RecipeAddSerializer
 
+    @action(detail=False, methods=['get'],
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь"""
+        paginator = FeedPagination()
+        page = paginator.paginate_queryset(
+            feed_sources(request.user), request, self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def pantry(self, request):
+        """Рецепты, для которых из ингредиентов ?ingredients= не хватает
+        не больше ?missing= штук, по убыванию доли имеющихся"""
+        serializer = PantrySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = pantry_index.search(
+            serializer.validated_data['ingredients'],
+            serializer.validated_data['missing'])
+        paginator = RankedPagination()
+        page = paginator.paginate_queryset(recipe_ids, request, self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk):
+        """Самые похожие рецепты по составу и тэгам из заранее
+        посчитанной таблицы SimilarRecipe"""
+        recipe = get_object_or_404(Recipe.objects.only('id'), id=pk)
+        recipes = self.get_queryset().filter(
+            similar_to__recipe=recipe).order_by('-similar_to__score', 'id')
+        serializer = self.get_serializer(recipes, many=True)
+        return Response(serializer.data)
+
     @action(detail=True, methods=['post'],
             permission_classes=[IsAuthenticated])
     def favorite(self, request, pk):
@@ -71,33 +151,49 @@ class RecipeViewSet(CreateDeleteModelMixin, viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'],
             permission_classes=[IsAuthenticated])
+    @transaction.atomic
     def shopping_cart(self, request, pk):
         data = {'user': request.user.id, 'recipe': pk}
         return self.create_obj(data, request, ShoppingCartSerializer)
 
     @shopping_cart.mapping.delete
+    @transaction.atomic
     def delete_shopping_cart(self, request, pk):
         kwargs = {'user': request.user,
                   'recipe': get_object_or_404(Recipe, id=pk)}
         return self.delete_obj(ShoppingCart, **kwargs)
 
+    @staticmethod
+    def get_shopping_cart_etag(user, renderer):
+        """ETag списка покупок по версиям из общего кэша: версия
+        пользователя растёт при любом изменении его позиций, общая —
+        при изменении ингредиентов и пересборке списков"""
+        versions = shopping_list_versions(user.id)
+        key = f'{renderer.format}:{user.id}:{versions}'
+        return quote_etag(md5(key.encode()).hexdigest())
+
     @action(detail=False, methods=['GET'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=SHOPPING_CART_RENDERERS)
     def download_shopping_cart(self, request):
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__shoppingcarts__user=request.user).values(
-            'ingredient__name', 'ingredient__measurement_unit').annotate(
-            amount=Sum('amount'))
-        shopping_cart = ['Список покупок:']
-        for ingredient in ingredients:
-            name = ingredient['ingredient__name']
-            measurement_unit = ingredient[
-                'ingredient__measurement_unit']
-            amount = ingredient['amount']
-            shopping_cart.append(f'\n{name} - {amount}, {measurement_unit}')
-        response = HttpResponse(shopping_cart, content_type='text/plain')
+        renderer = request.accepted_renderer
+        etag = self.get_shopping_cart_etag(request.user, renderer)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user).order_by('ingredient__name').values_list(
+            'ingredient__name', 'ingredient__measurement_unit',
+            'total_amount')
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=(f'{renderer.media_type}; charset={renderer.charset}'
+                          if renderer.charset else renderer.media_type)
+        )
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
         response['Content-Disposition'] = (
-            'attachment; filename="shopping_cart.txt"'
+            f'attachment; filename="shopping_cart.{renderer.extension}"'
         )
         return response
 
@@ -106,6 +202,7 @@ class SubcsribeView(CreateDeleteModelMixin, UserViewSet):
     """Работа с подписками. Получение всего списка
     Подписка и отписка от других авторов"""
     queryset = User.objects.all()
+    cursor_ordering = ('username', 'id')
 
     @action(detail=True, methods=['post'],
             permission_classes=[IsAuthenticated])
@@ -122,8 +219,10 @@ class SubcsribeView(CreateDeleteModelMixin, UserViewSet):
 
     @action(detail=False, methods=['get'])
     def subscriptions(self, request):
-        queryset = User.objects.filter(following__user=request.user)
+        queryset = SubscriptionsSerializer.annotate_authors(
+            User.objects.filter(following__user=request.user))
         page = self.paginate_queryset(queryset)
+        SubscriptionsSerializer.prefetch_recipes(page, request)
         serializer = SubscriptionsSerializer(
             page, context={'request': request}, many=True)
         return self.get_paginated_response(serializer.data)
@@ -0,0 +1,193 @@
+import math
+from threading import Lock, Thread
+from time import monotonic, time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+
+LIST_VERSION_KEY = 'recipes:version'
+CATALOG_VERSION_KEY = 'recipes:catalog:version'
+RECIPE_VERSION_KEY = 'recipes:version:{}'
+SHOPPING_LIST_VERSION_KEY = 'shopping_list:version:{}'
+SHOPPING_LISTS_VERSION_KEY = 'shopping_list:version'
+
+# Бэкенды, общие для процессов, с атомарными incr и add
+ATOMIC_CACHE_BACKENDS = (
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+    'django.core.cache.backends.memcached.MemcachedCache',
+    'django_redis.cache.RedisCache',
+)
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def get_version_cache():
+    return caches[settings.VERSION_CACHE_ALIAS]
+
+
+def is_shared_cache():
+    """Видят ли другие процессы версии, записанные этим процессом"""
+    return not isinstance(get_version_cache(), (DummyCache, LocMemCache))
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_version_cache(app_configs, **kwargs):
+    backend = settings.CACHES[settings.VERSION_CACHE_ALIAS]['BACKEND']
+    if backend in ATOMIC_CACHE_BACKENDS:
+        return []
+    return [checks.Error(
+        f'Кэш версий {backend} не общий или не атомарный: '
+        'инвалидации кэшей и отзыв токенов будут теряться',
+        hint='Задайте CACHE_BACKEND с memcached или redis',
+        id='foodgram.E001',
+    )]
+
+
+def get_version(key):
+    """Текущая версия; после вытеснения из кэша начинается с метки
+    времени, чтобы не совпасть со старыми ключами"""
+    cache = get_version_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time() * 1000), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_version(key):
+    """Увеличивает версию и возвращает новую"""
+    cache = get_version_cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = int(time() * 1000)
+        cache.set(key, version, None)
+        return version
+
+
+def bump_recipe(recipe_id):
+    bump_recipes((recipe_id, ))
+
+
+def bump_recipes(recipe_ids):
+    for recipe_id in recipe_ids:
+        bump_version(RECIPE_VERSION_KEY.format(recipe_id))
+    bump_version(LIST_VERSION_KEY)
+
+
+def bump_catalog():
+    bump_version(CATALOG_VERSION_KEY)
+    bump_version(LIST_VERSION_KEY)
+
+
+def bump_shopping_lists(user_ids=None):
+    """Меняет ETag списков покупок пользователей; без user_ids — всех,
+    например после переименования ингредиента"""
+    if user_ids is None:
+        bump_version(SHOPPING_LISTS_VERSION_KEY)
+        return
+    for user_id in user_ids:
+        bump_version(SHOPPING_LIST_VERSION_KEY.format(user_id))
+
+
+def shopping_list_versions(user_id):
+    return (get_version(SHOPPING_LIST_VERSION_KEY.format(user_id)),
+            get_version(SHOPPING_LISTS_VERSION_KEY))
+
+
+def local_max_age(seconds):
+    """Сколько секунд копия в памяти процесса живёт без пересборки.
+    Если кэш версий не общий, изменения других процессов до копии не
+    дойдут, поэтому срок сокращается до LOCAL_CACHE_UNSHARED_MAX_AGE"""
+    if is_shared_cache():
+        return seconds
+    return min(seconds, settings.LOCAL_CACHE_UNSHARED_MAX_AGE)
+
+
+class LocalCopy:
+    """Данные в памяти процесса, сверяемые с версией в общем кэше.
+
+    Версия сверяется не чаще раза в check_interval секунд. Копия
+    собирается заново, если версия изменилась и update не смог
+    применить изменения, и в любом случае через max_age секунд после
+    сборки (local_max_age). check_interval и max_age — имена настроек.
+    С background=True пересобирает копию фоновый поток, а до конца
+    сборки отдаётся прежняя; синхронна только первая сборка."""
+
+    def __init__(self, version_key, check_interval=None, max_age=None,
+                 background=False):
+        self.version_key = version_key
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.background = background
+        self._lock = Lock()
+        self._value = None
+        self._version = None
+        self._checked_at = -math.inf
+        self._built_at = -math.inf
+        self._rebuilding = False
+
+    def invalidate(self, drop=False):
+        """Увеличивает общую версию и возвращает новую; drop сбрасывает
+        и копию этого процесса, чтобы следующий get собрал её сразу"""
+        version = bump_version(self.version_key)
+        if drop:
+            self._value = None
+        self._checked_at = -math.inf
+        return version
+
+    def get(self, build, update=None):
+        """Копия данных. build() собирает её заново, update(value,
+        old_version, new_version) возвращает копию с изменениями между
+        версиями или None, если их не восстановить"""
+        now = monotonic()
+        value = self._value
+        if value is not None and now - self._checked_at < self._setting(
+                self.check_interval, 0):
+            return value
+        version = get_version(self.version_key)
+        with self._lock:
+            self._checked_at = now
+            expired = now - self._built_at >= local_max_age(
+                self._setting(self.max_age, math.inf))
+            if self._value is None:
+                self._store(build(), version)
+            elif not self._rebuilding and (expired
+                                           or version != self._version):
+                value = None
+                if update is not None and not expired:
+                    value = update(self._value, self._version, version)
+                if value is not None:
+                    self._value, self._version = value, version
+                elif self.background:
+                    self._rebuilding = True
+                    Thread(target=self._rebuild, args=(build, version),
+                           daemon=True).start()
+                else:
+                    self._store(build(), version)
+            return self._value
+
+    @staticmethod
+    def _setting(name, default):
+        return default if name is None else getattr(settings, name)
+
+    def _store(self, value, version):
+        self._value, self._version = value, version
+        self._built_at = monotonic()
+
+    def _rebuild(self, build, version):
+        try:
+            value = build()
+            with self._lock:
+                self._store(value, version)
+        finally:
+            self._rebuilding = False
+            self._checked_at = -math.inf
+            connections.close_all()
@@ -0,0 +1,17 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Алиас реплики, выбранной для текущего запроса; None — основная база
+current_replica = ContextVar('current_replica', default=None)
+
+
+@contextmanager
+def primary():
+    """Чтения внутри блока идут в основную базу. Нужен для всего, что
+    собирается один раз и затем раздаётся из кэша: собранное по
+    отстающей реплике осталось бы устаревшим до следующей пересборки"""
+    token = current_replica.set(None)
+    try:
+        yield
+    finally:
+        current_replica.reset(token)
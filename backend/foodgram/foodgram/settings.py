@@ -1,4 +1,5 @@
 import os
+import sys
 from distutils.util import strtobool
 from pathlib import Path
 
@@ -31,6 +32,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
+    'api.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,6 +75,68 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения: DB_REPLICA_HOSTS=host1:5432,host2:5432.
+# Безопасные запросы читают из реплики, выбранной по кругу (round_robin)
+# или с наименьшим отставанием (least_lag); после записи клиент на
+# DATABASE_REPLICA_STICKY_SECONDS закрепляется за основной базой
+DATABASE_REPLICAS = []
+for number, address in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['api.db.ReplicaRouter']
+DATABASE_REPLICA_SELECTION = os.getenv(
+    'DB_REPLICA_SELECTION', 'round_robin')
+DATABASE_REPLICA_STICKY_SECONDS = 5
+DATABASE_REPLICA_MAX_LAG = 10
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = 1
+
+# Версии кэшей и отзыв токенов должны быть видны всем процессам
+# gunicorn и командам manage.py и увеличиваться атомарно, поэтому в
+# продакшене нужен memcached или redis (проверяет check --deploy).
+# Файловый кэш по умолчанию годится только для разработки: его incr и
+# add не атомарны. Счётчики версий лежат в отдельном алиасе: файловый и
+# локальный кэши вытесняют записи сверх MAX_ENTRIES, и ответы не
+# должны вытеснять версии
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache')
+CACHE_LOCATION = os.getenv('CACHE_LOCATION', '/tmp/foodgram_cache')
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 100000))
+CULLED_CACHE_BACKENDS = (
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+def cache_options(max_entries):
+    if CACHE_BACKEND in CULLED_CACHE_BACKENDS:
+        return {'MAX_ENTRIES': max_entries}
+    return {}
+
+
+VERSION_CACHE_ALIAS = 'versions'
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': CACHE_LOCATION,
+        'OPTIONS': cache_options(CACHE_MAX_ENTRIES),
+    },
+    VERSION_CACHE_ALIAS: {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('VERSION_CACHE_LOCATION', CACHE_LOCATION
+                              if CACHE_BACKEND not in CULLED_CACHE_BACKENDS
+                              else '/tmp/foodgram_versions'),
+        'KEY_PREFIX': 'versions',
+        'OPTIONS': cache_options(sys.maxsize),
+    },
+}
+
 AUTH_USER_MODEL = 'users.User'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -115,7 +180,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.CustomPagination',
     'PAGE_SIZE': 6,
@@ -152,3 +217,83 @@ MAX_LENGTH_TAG_SLUG = 200
 MAX_LENGTH_INGREDIENT_NAME = 200
 MAX_LENGTH_INGREDIENT_MEASUREMENT_UNUT = 200
 MAX_LENGTH_RECIPE_NAME = 200
+
+# Кэш ответов со списком и карточками рецептов для анонимных
+# пользователей: алиас из CACHES, время жизни и время ожидания
+# пересборки ключа другим процессом, в секундах
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = 600
+RESPONSE_CACHE_LOCK_TIMEOUT = 5
+
+# Сколько секунд собранное тело справочника отдаётся без сверки с БД,
+# даже если версия каталога в кэше не менялась
+CATALOG_CACHE_MAX_AGE = 60
+
+# Размер и время жизни (в секундах) кэша токенов авторизации
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 300
+# Сколько секунд живут копии в памяти процесса (индексы, справочники,
+# токены), если кэш версий не общий и изменения других процессов до
+# них не доходят
+LOCAL_CACHE_UNSHARED_MAX_AGE = 5
+
+# Конфигурация полнотекстового поиска PostgreSQL
+SEARCH_CONFIG = 'russian'
+
+# Как часто (в секундах) процесс сверяет версию индекса ингредиентов
+# и как часто пересобирает его в любом случае
+INGREDIENT_INDEX_CHECK_INTERVAL = 5
+INGREDIENT_INDEX_MAX_AGE = 300
+# Индекс «что приготовить из имеющегося»: как часто процесс сверяет
+# его версию и пересобирает его в любом случае, сколько секунд
+# хранятся списки изменённых рецептов, при каком отставании индекс
+# пересобирается целиком и сколько ингредиентов можно передать в
+# одном запросе
+PANTRY_INDEX_CHECK_INTERVAL = 30
+PANTRY_INDEX_MAX_AGE = 3600
+PANTRY_INDEX_CHANGES_TIMEOUT = 3600
+PANTRY_INDEX_MAX_CHANGES = 1000
+PANTRY_MAX_INGREDIENTS = 100
+
+# Размер миниатюры рецепта и качество фоновых копий изображений
+RECIPE_THUMBNAIL_SIZE = (480, 320)
+RECIPE_IMAGE_QUALITY = 80
+IMAGE_TASK_MAX_ATTEMPTS = 3
+# Срок кэширования медиафайлов: их имена зависят от содержимого
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+
+# TTF-шрифт с кириллицей для выгрузки списка покупок в PDF
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Ленты подписок: рецепты авторов, у которых подписчиков больше
+# FEED_FANOUT_MAX_FOLLOWERS, читаются при запросе ленты, а не рассылаются
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+FEED_FANOUT_BATCH_SIZE = 1000
+FEED_BACKFILL_SIZE = 50
+FEED_POPULAR_AUTHORS_TTL = 60
+FEED_TASK_MAX_ATTEMPTS = 3
+
+# Похожие рецепты: сколько соседей хранится для каждого рецепта и
+# вес совпадения тэга относительно совпадения ингредиента
+SIMILAR_RECIPES_COUNT = 10
+SIMILAR_RECIPES_TAG_WEIGHT = 0.5
+
+# Счётчики запросов к БД и заголовок Server-Timing; N+1 считается
+# запрос, повторённый за один HTTP-запрос не меньше указанного числа раз
+REQUEST_METRICS_ENABLED = bool(
+    strtobool(os.getenv('REQUEST_METRICS_ENABLED', 'False')))
+REQUEST_METRICS_DUPLICATE_THRESHOLD = 3
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.metrics': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
@@ -0,0 +1,18 @@
+import os
+import shutil
+
+# Каталог для mmap-файлов метрик prometheus_client: каждый воркер пишет
+# в свои файлы, а /api/metrics/ суммирует их по всем процессам
+multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+
+def on_starting(server):
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir)
+
+
+def child_exit(server, worker):
+    if multiproc_dir:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
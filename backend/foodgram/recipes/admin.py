@@ -1,46 +1,131 @@
+from contextlib import contextmanager
+
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import Count
+
+from recipes.models import (Favorite, FeedTask, ImageTask, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListItem,
+                            Tag)
+
 
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
+@contextmanager
+def shopping_lists_follow(recipe_ids):
+    """Переносит правку состава рецептов в списки покупок тех, у кого
+    рецепты лежат в корзине"""
+    old_amounts = {recipe_id: ShoppingListItem.objects.recipe_amounts(
+        recipe_id) for recipe_id in recipe_ids}
+    yield
+    for recipe_id, amounts in old_amounts.items():
+        ShoppingListItem.objects.change_recipe(
+            recipe_id, amounts,
+            ShoppingListItem.objects.recipe_amounts(recipe_id))
 
 
 class RecipeIngredientInLine(admin.TabularInline):
     model = RecipeIngredient
     extra = 1
+    autocomplete_fields = ('ingredient', )
 
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'measurement_unit')
-    list_filter = ('name',)
+    list_filter = ('measurement_unit',)
     search_fields = ('name',)
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     list_display = ('name', 'author', 'in_favorited')
-    list_filter = ('name', 'author', 'tags')
+    list_filter = ('tags', )
+    list_select_related = ('author', )
+    search_fields = ('name', 'author__username', 'author__email')
+    autocomplete_fields = ('author', 'tags')
     inlines = (RecipeIngredientInLine, )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            favorites_count=Count('favorites'))
+
+    def save_related(self, request, form, formsets, change):
+        with shopping_lists_follow((form.instance.id, ) if change else ()):
+            super().save_related(request, form, formsets, change)
+        Recipe.objects.filter(id=form.instance.id).update(similar_stale=True)
+
+    @admin.display(description='В избранном', ordering='favorites_count')
     def in_favorited(self, recipes):
-        return recipes.favorites.count()
+        return recipes.favorites_count
 
 
-@admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class UserRecipeAdmin(admin.ModelAdmin):
+    """Общая админка для избранного и списков покупок"""
     list_display = ('id', 'user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    search_fields = ('user__username', 'user__email', 'recipe__name')
+    autocomplete_fields = ('user', 'recipe')
+
+
+@admin.register(Favorite)
+class FavoriteAdmin(UserRecipeAdmin):
+    pass
+
+
+class RecipeTaskAdmin(admin.ModelAdmin):
+    """Общая админка для очередей фоновых задач"""
+    list_display = ('id', 'recipe', 'created', 'attempts', 'error')
+    list_select_related = ('recipe', )
+    autocomplete_fields = ('recipe', )
+
+
+@admin.register(FeedTask)
+class FeedTaskAdmin(RecipeTaskAdmin):
+    pass
+
+
+@admin.register(ImageTask)
+class ImageTaskAdmin(RecipeTaskAdmin):
+    pass
 
 
 @admin.register(RecipeIngredient)
 class RecipeIngredientAdmin(admin.ModelAdmin):
     list_display = ('id', 'recipe', 'ingredient', 'amount')
+    list_select_related = ('recipe', 'ingredient')
+    search_fields = ('recipe__name', 'ingredient__name')
+    autocomplete_fields = ('recipe', 'ingredient')
+
+    def save_model(self, request, obj, form, change):
+        recipe_ids = {obj.recipe_id} | set(RecipeIngredient.objects.filter(
+            pk=obj.pk).values_list('recipe_id', flat=True))
+        with shopping_lists_follow(recipe_ids):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with shopping_lists_follow((obj.recipe_id, )):
+            super().delete_model(request, obj)
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        with shopping_lists_follow(recipe_ids):
+            super().delete_queryset(request, queryset)
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'recipe')
+class ShoppingCartAdmin(UserRecipeAdmin):
+    pass
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'ingredient', 'total_amount')
+    list_select_related = ('user', 'ingredient')
+    search_fields = ('user__username', 'user__email', 'ingredient__name')
+    autocomplete_fields = ('user', 'ingredient')
 
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'slug')
+    search_fields = ('name', 'slug')
@@ -0,0 +1,66 @@
+from bisect import bisect_left
+
+from foodgram.cache import LocalCopy
+from foodgram.db import primary
+
+VERSION_CACHE_KEY = 'ingredients:index:version'
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Хранит отсортированный список названий в нижнем регистре,
+    поиск по префиксу выполняется бинарным поиском без обращения к БД.
+    Копия сверяется с версией в общем кэше раз в
+    INGREDIENT_INDEX_CHECK_INTERVAL секунд и пересобирается не реже
+    раза в INGREDIENT_INDEX_MAX_AGE секунд (LocalCopy)."""
+
+    def __init__(self):
+        self._copy = LocalCopy(VERSION_CACHE_KEY,
+                               'INGREDIENT_INDEX_CHECK_INTERVAL',
+                               'INGREDIENT_INDEX_MAX_AGE')
+
+    def invalidate(self):
+        """Сбрасывает индекс и увеличивает общую версию"""
+        self._copy.invalidate(drop=True)
+
+    def search(self, query, limit=None):
+        """Возвращает ингредиенты, название которых начинается с query,
+        а после них — содержащие query в середине названия"""
+        keys, items = self._copy.get(self._build)
+        query = query.strip().casefold()
+        if not query:
+            return list(items[:limit])
+        start = position = bisect_left(keys, query)
+        while position < len(keys) and keys[position].startswith(query):
+            position += 1
+        result = list(items[start:position])
+        if limit is not None and len(result) >= limit:
+            return result[:limit]
+        for index, key in enumerate(keys):
+            if query in key and not key.startswith(query):
+                result.append(items[index])
+                if limit is not None and len(result) >= limit:
+                    break
+        return result
+
+    @staticmethod
+    def _build():
+        from recipes.models import Ingredient
+
+        with primary():
+            rows = sorted(
+                (name.casefold(), pk, name, measurement_unit)
+                for pk, name, measurement_unit
+                in Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit').iterator()
+            )
+        keys = [row[0] for row in rows]
+        items = tuple(
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, pk, name, measurement_unit in rows
+        )
+        return keys, items
+
+
+ingredient_index = IngredientIndex()
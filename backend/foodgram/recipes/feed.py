@@ -0,0 +1,116 @@
+from django.conf import settings
+from django.db.models import Count
+
+from foodgram.cache import get_cache, get_version_cache
+from recipes.models import FeedTask, Recipe, TimelineEntry
+from users.models import Subscribe
+
+POPULAR_AUTHORS_KEY = 'feed:popular_authors'
+PREVIOUS_POPULAR_AUTHORS_KEY = 'feed:popular_authors:previous'
+
+
+def popular_author_ids():
+    """Авторы, у которых подписчиков больше FEED_FANOUT_MAX_FOLLOWERS.
+
+    Их рецепты не рассылаются по лентам, а читаются при запросе ленты.
+    Список хранится в общем кэше FEED_POPULAR_AUTHORS_TTL секунд.
+    Предыдущий список лежит в невытесняемом кэше версий: рецепты
+    авторов, выбывших из него, ставятся в очередь рассылки."""
+    cache = get_cache()
+    author_ids = cache.get(POPULAR_AUTHORS_KEY)
+    if author_ids is None:
+        author_ids = frozenset(
+            Subscribe.objects.values('following_id').annotate(
+                followers=Count('id')).filter(
+                followers__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+            ).order_by().values_list('following_id', flat=True))
+        previous = get_version_cache().get(PREVIOUS_POPULAR_AUTHORS_KEY)
+        if previous is not None and previous - author_ids:
+            enqueue_recent(previous - author_ids)
+        get_version_cache().set(PREVIOUS_POPULAR_AUTHORS_KEY, author_ids,
+                                None)
+        cache.set(POPULAR_AUTHORS_KEY, author_ids,
+                  settings.FEED_POPULAR_AUTHORS_TTL)
+    return author_ids
+
+
+def recent_recipes(author_id):
+    """Последние FEED_BACKFILL_SIZE рецептов автора"""
+    return Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id').only(
+        'id', 'author_id', 'pub_date')[:settings.FEED_BACKFILL_SIZE]
+
+
+def enqueue_recent(author_ids):
+    """Ставит в очередь рассылки последние рецепты авторов, которые
+    перестали быть популярными: опубликованные, пока автор был
+    популярным, в ленты подписчиков не попали"""
+    FeedTask.objects.bulk_create(
+        FeedTask(recipe_id=recipe.id)
+        for author_id in author_ids
+        for recipe in recent_recipes(author_id))
+
+
+def make_entries(recipe, user_ids):
+    return [TimelineEntry(user_id=user_id, recipe_id=recipe.id,
+                          author_id=recipe.author_id,
+                          pub_date=recipe.pub_date)
+            for user_id in user_ids]
+
+
+def fan_out(recipe):
+    """Добавляет рецепт в ленты подписчиков автора пачками по
+    FEED_FANOUT_BATCH_SIZE. Возвращает число подписчиков"""
+    if recipe.author_id in popular_author_ids():
+        return 0
+    batch_size = settings.FEED_FANOUT_BATCH_SIZE
+    followers = Subscribe.objects.filter(
+        following_id=recipe.author_id).order_by('user_id').values_list(
+        'user_id', flat=True)
+    total, last_id = 0, 0
+    while True:
+        user_ids = list(followers.filter(user_id__gt=last_id)[:batch_size])
+        if not user_ids:
+            return total
+        TimelineEntry.objects.bulk_create(
+            make_entries(recipe, user_ids), ignore_conflicts=True)
+        total += len(user_ids)
+        last_id = user_ids[-1]
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние FEED_BACKFILL_SIZE рецептов автора,
+    на которого подписался пользователь"""
+    if author_id in popular_author_ids():
+        return
+    TimelineEntry.objects.bulk_create(
+        (entry for recipe in recent_recipes(author_id)
+         for entry in make_entries(recipe, (user_id, ))),
+        ignore_conflicts=True)
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты рецепты автора после отписки"""
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def feed_sources(user):
+    """Источники ленты, упорядоченные по (pub_date, id рецепта): записи
+    из таблицы лент и рецепты популярных авторов, на которых подписан
+    пользователь. Записи популярных авторов в таблице не учитываются,
+    чтобы рецепт не попал в ленту дважды после смены статуса автора"""
+    popular = popular_author_ids()
+    sources = [(
+        TimelineEntry.objects.filter(user=user).exclude(
+            author_id__in=popular),
+        ('-pub_date', '-recipe_id'),
+    )]
+    if popular:
+        followed = Subscribe.objects.filter(
+            user=user, following_id__in=popular).values_list(
+            'following_id', flat=True)
+        sources.append((
+            Recipe.objects.filter(author_id__in=followed),
+            ('-pub_date', '-id'),
+        ))
+    return sources
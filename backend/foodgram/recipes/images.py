@@ -0,0 +1,27 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+
+def render(image, image_format):
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=settings.RECIPE_IMAGE_QUALITY)
+    return ContentFile(buffer.getvalue())
+
+
+def make_renditions(recipe):
+    """Создаёт миниатюру и WebP-копию изображения рецепта"""
+    with recipe.image.open('rb') as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image = image.convert('RGB')
+    name = os.path.splitext(os.path.basename(recipe.image.name))[0]
+    thumbnail = ImageOps.fit(image, settings.RECIPE_THUMBNAIL_SIZE,
+                             Image.LANCZOS)
+    recipe.thumbnail.save(f'{name}.jpg', render(thumbnail, 'JPEG'),
+                          save=False)
+    recipe.image_webp.save(f'{name}.webp', render(image, 'WEBP'),
+                           save=False)
+    recipe.save(update_fields=('thumbnail', 'image_webp'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import SimilarRecipe
+from recipes.similar import build, refresh, stale_recipe_ids
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает похожие рецепты для рецептов, у которых '
+            'изменился состав или тэги, или для всех (--full)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать соседей всех рецептов')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['full'] or not SimilarRecipe.objects.exists():
+                recipes = build()
+            else:
+                stale_ids = stale_recipe_ids()
+                if not stale_ids:
+                    self.stdout.write('Похожие рецепты актуальны')
+                    return
+                recipes = refresh(stale_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожие рецепты пересчитаны, рецептов: {recipes}'))
@@ -0,0 +1,38 @@
+from django.db import transaction
+
+from recipes.feed import backfill, fan_out
+from recipes.management.worker import WorkerCommand
+from recipes.models import FeedTask, TimelineEntry
+from users.models import Subscribe
+
+
+class Command(WorkerCommand):
+    help = ('Фоновый обработчик очереди рассылки: добавляет новые рецепты '
+            'в ленты подписчиков их авторов')
+    model = FeedTask
+    max_attempts_setting = 'FEED_TASK_MAX_ATTEMPTS'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Пересобрать все ленты по подпискам и завершиться')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.rebuild()
+            return
+        super().handle(*args, **options)
+
+    def process(self, task):
+        return f'подписчиков {fan_out(task.recipe)}'
+
+    def rebuild(self):
+        with transaction.atomic():
+            TimelineEntry.objects.all().delete()
+            subscriptions = Subscribe.objects.order_by('id').values_list(
+                'user_id', 'following_id')
+            for user_id, author_id in subscriptions.iterator():
+                backfill(user_id, author_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты пересобраны, записей: {TimelineEntry.objects.count()}'))
@@ -0,0 +1,54 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import Recipe
+from recipes.storage import recipe_image_storage
+
+IMAGE_FIELDS = ('image', 'thumbnail', 'image_webp')
+
+
+def walk(storage, path):
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield os.path.join(path, name)
+    for directory in directories:
+        yield from walk(storage, os.path.join(path, directory))
+
+
+class Command(BaseCommand):
+    help = ('Удаляет изображения рецептов, на которые не ссылается '
+            'ни один рецепт')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Не трогать файлы моложе указанного числа секунд')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать файлы, которые будут удалены')
+
+    def handle(self, *args, **options):
+        storage = recipe_image_storage
+        if not storage.exists('recipes'):
+            return
+        referenced = set()
+        for names in Recipe.objects.values_list(*IMAGE_FIELDS).iterator():
+            referenced.update(name for name in names if name)
+        border = timezone.now() - timedelta(seconds=options['min_age'])
+        removed = freed = 0
+        for name in walk(storage, 'recipes'):
+            if name in referenced or storage.get_modified_time(name) > border:
+                continue
+            size = storage.size(name)
+            if options['dry_run']:
+                self.stdout.write(f'- {name}')
+            else:
+                storage.delete(name)
+            removed += 1
+            freed += size
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} файлов: {removed}, {freed / 1024 / 1024:.1f} МБ'))
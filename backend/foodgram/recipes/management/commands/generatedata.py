@@ -0,0 +1,212 @@
+import io
+import random
+from itertools import accumulate
+from time import monotonic
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from PIL import Image
+
+from foodgram.cache import bump_catalog
+from recipes.management.commands.importcsv import batches
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from recipes.pantry import pantry_index
+from users.models import Subscribe
+
+User = get_user_model()
+
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F2C94C', 'dessert'),
+    ('Выпечка', '#B5651D', 'bakery'),
+    ('Салат', '#27AE60', 'salad'),
+    ('Суп', '#2D9CDB', 'soup'),
+    ('Вегетарианское', '#6FCF97', 'vegetarian'),
+)
+DISHES = ('Запеканка', 'Салат', 'Суп', 'Рагу', 'Пирог', 'Омлет', 'Паста',
+          'Каша', 'Котлеты', 'Оладьи', 'Плов', 'Соус', 'Смузи', 'Рулет')
+PASSWORD = 'bench-password'
+
+
+def zipf_weights(size, exponent=1.1):
+    """Накопленные веса распределения Ципфа: немногие элементы
+    популярны, длинный хвост встречается редко"""
+    return list(accumulate(1 / (rank + 1) ** exponent
+                           for rank in range(size)))
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, рецептами, '
+            'подписками, избранным, корзинами, лентами и похожими '
+            'рецептами для нагрузочных замеров')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='Сколько пользователей создать')
+        parser.add_argument(
+            '--recipes', type=int, default=10000,
+            help='Сколько рецептов создать')
+        parser.add_argument(
+            '--subscriptions', type=int, default=20,
+            help='Среднее число подписок на пользователя')
+        parser.add_argument(
+            '--favorites', type=int, default=30,
+            help='Среднее число рецептов в избранном у пользователя')
+        parser.add_argument(
+            '--cart', type=int, default=5,
+            help='Среднее число рецептов в корзине у пользователя')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Сколько строк вставлять за один запрос')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Зерно генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = monotonic()
+        if not Ingredient.objects.exists():
+            call_command('importcsv', stdout=self.stdout)
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        self.random.shuffle(ingredient_ids)
+        tag_ids = self.create_tags()
+        with transaction.atomic():
+            user_ids = self.create_users(options['users'])
+            if not user_ids:
+                raise CommandError('Нужен хотя бы один пользователь')
+            self.random.shuffle(user_ids)
+            author_weights = zipf_weights(len(user_ids))
+            recipe_ids = self.create_recipes(
+                options['recipes'], user_ids, author_weights)
+            self.create_ingredients(recipe_ids, ingredient_ids)
+            self.create_tags_links(recipe_ids, tag_ids)
+            self.create_subscriptions(
+                user_ids, author_weights, options['subscriptions'])
+            popular = self.random.sample(recipe_ids, len(recipe_ids))
+            for model, average in ((Favorite, options['favorites']),
+                                   (ShoppingCart, options['cart'])):
+                self.create_user_recipes(model, user_ids, popular, average)
+        call_command('rebuildshoppinglists', stdout=self.stdout)
+        call_command('fanout', rebuild=True, stdout=self.stdout)
+        call_command('buildsimilar', stdout=self.stdout)
+        if connection.vendor == 'postgresql':
+            Recipe.objects.filter(id__in=recipe_ids).update_search_vectors()
+        bump_catalog()
+        pantry_index.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(user_ids)}, '
+            f'рецептов: {len(recipe_ids)} '
+            f'за {monotonic() - started:.1f} с'))
+
+    def bulk_create(self, model, objects):
+        for batch in batches(objects, self.batch_size):
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+
+    def new_ids(self, model, last_id):
+        return list(model.objects.filter(id__gt=last_id)
+                    .order_by('id').values_list('id', flat=True))
+
+    def last_id(self, model):
+        return model.objects.order_by('-id').values_list(
+            'id', flat=True).first() or 0
+
+    def create_tags(self):
+        for name, color, slug in TAGS:
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color})
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def create_users(self, count):
+        last_id = self.last_id(User)
+        password = make_password(PASSWORD)
+        self.bulk_create(User, (
+            User(username=f'bench{last_id + number}',
+                 email=f'bench{last_id + number}@example.com',
+                 first_name='Тест', last_name=f'Пользователь {number}',
+                 password=password)
+            for number in range(1, count + 1)
+        ))
+        return self.new_ids(User, last_id)
+
+    def create_recipes(self, count, user_ids, author_weights):
+        last_id = self.last_id(Recipe)
+        image = self.make_image()
+        authors = self.random.choices(
+            user_ids, cum_weights=author_weights, k=count)
+        self.bulk_create(Recipe, (
+            Recipe(author_id=author_id,
+                   name=f'{self.random.choice(DISHES)} №{last_id + number}',
+                   text='Синтетический рецепт для нагрузочных замеров.',
+                   cooking_time=self.random.randint(5, 180),
+                   image=image)
+            for number, author_id in enumerate(authors, 1)
+        ))
+        return self.new_ids(Recipe, last_id)
+
+    def make_image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), (230, 180, 120)).save(buffer, 'JPEG')
+        field = Recipe._meta.get_field('image')
+        return field.storage.save(
+            field.generate_filename(None, 'generated.jpg'),
+            ContentFile(buffer.getvalue()))
+
+    def create_ingredients(self, recipe_ids, ingredient_ids):
+        weights = zipf_weights(len(ingredient_ids))
+
+        def rows():
+            for recipe_id in recipe_ids:
+                chosen = set(self.random.choices(
+                    ingredient_ids, cum_weights=weights,
+                    k=self.random.randint(3, 12)))
+                for ingredient_id in chosen:
+                    yield RecipeIngredient(
+                        recipe_id=recipe_id, ingredient_id=ingredient_id,
+                        amount=self.random.choice((1, 2, 5, 10, 50, 100, 200)))
+        self.bulk_create(RecipeIngredient, rows())
+
+    def create_tags_links(self, recipe_ids, tag_ids):
+        through = Recipe.tags.through
+        self.bulk_create(through, (
+            through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in self.random.sample(
+                tag_ids, min(len(tag_ids), self.random.randint(1, 3)))
+        ))
+
+    def sample_count(self, average, limit):
+        return min(limit, int(self.random.expovariate(1 / average))
+                   if average else 0)
+
+    def create_subscriptions(self, user_ids, author_weights, average):
+        def rows():
+            for user_id in user_ids:
+                count = self.sample_count(average, len(user_ids) - 1)
+                authors = set(self.random.choices(
+                    user_ids, cum_weights=author_weights, k=count))
+                authors.discard(user_id)
+                for author_id in authors:
+                    yield Subscribe(user_id=user_id, following_id=author_id)
+        self.bulk_create(Subscribe, rows())
+
+    def create_user_recipes(self, model, user_ids, recipe_ids, average):
+        if not recipe_ids:
+            return
+        recipe_weights = zipf_weights(len(recipe_ids))
+
+        def rows():
+            for user_id in user_ids:
+                count = self.sample_count(average, len(recipe_ids))
+                for recipe_id in set(self.random.choices(
+                        recipe_ids, cum_weights=recipe_weights, k=count)):
+                    yield model(user_id=user_id, recipe_id=recipe_id)
+        self.bulk_create(model, rows())
@@ -1,27 +1,145 @@
 ﻿import csv
+import json
 import os
+from itertools import islice
+from tempfile import SpooledTemporaryFile
+from time import monotonic
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from foodgram.cache import bump_catalog
+from recipes.autocomplete import ingredient_index
 from recipes.models import Ingredient
 
+DEFAULT_FILE = os.path.join(settings.BASE_DIR, 'recipes/data/ingredients.csv')
+HEADER = ('name', 'measurement_unit')
 
-def process_file(name: str):
-    return csv.reader(open(os.path.join(
-        settings.BASE_DIR, 'recipes/data/', name),
-        'r', encoding='utf-8'), delimiter=',')
+
+def read_csv(file):
+    for row in csv.reader(file, delimiter=','):
+        if len(row) < 2 or tuple(row[:2]) == HEADER:
+            continue
+        yield row[0].strip(), row[1].strip()
+
+
+def read_json(file):
+    for item in json.load(file):
+        yield item['name'].strip(), item['measurement_unit'].strip()
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
 
 
 class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=DEFAULT_FILE,
+            help='Путь к файлу, по умолчанию recipes/data/ingredients.csv')
+        parser.add_argument(
+            '--format', choices=('csv', 'json'),
+            help='Формат файла, по умолчанию определяется по расширению')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Сколько строк вставлять за один запрос')
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Загрузка через COPY во временную таблицу (PostgreSQL)')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Показать, что будет добавлено, не изменяя базу')
 
     def handle(self, *args, **options):
+        path = options['path']
+        file_format = (options['format']
+                       or os.path.splitext(path)[1].lstrip('.').lower())
+        readers = {'csv': read_csv, 'json': read_json}
+        if file_format not in readers:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy поддерживается только в PostgreSQL')
+        started = monotonic()
+        before = Ingredient.objects.count()
+        with open(path, 'r', encoding='utf-8-sig') as file:
+            rows = readers[file_format](file)
+            if options['dry_run']:
+                self.diff(rows)
+                return
+            if options['copy']:
+                total = self.copy(rows)
+            else:
+                total = self.bulk_create(rows, options['batch_size'], started)
+        ingredient_index.invalidate()
+        bump_catalog()
+        created = Ingredient.objects.count() - before
+        elapsed = monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано строк: {total}, добавлено ингредиентов: {created} '
+            f'за {elapsed:.2f} с ({total / max(elapsed, 1e-6):.0f} строк/с)'))
+
+    def bulk_create(self, rows, batch_size, started):
+        total = 0
+        for batch in batches(rows, batch_size):
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=name, measurement_unit=measurement_unit)
+                 for name, measurement_unit in batch),
+                ignore_conflicts=True
+            )
+            total += len(batch)
+            self.stdout.write(
+                f'Обработано строк: {total} '
+                f'({total / max(monotonic() - started, 1e-6):.0f} строк/с)')
+        return total
+
+    def copy(self, rows):
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        total = 0
+        with SpooledTemporaryFile(mode='w+', encoding='utf-8') as buffer:
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow(row)
+                total += 1
+            buffer.seek(0)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    'CREATE TEMP TABLE ingredient_staging '
+                    '(name varchar(200), measurement_unit varchar(200)) '
+                    'ON COMMIT DROP')
+                cursor.copy_expert(
+                    'COPY ingredient_staging (name, measurement_unit) '
+                    'FROM STDIN WITH (FORMAT csv)', buffer)
+                cursor.execute(
+                    f'INSERT INTO {table} (name, measurement_unit) '
+                    'SELECT DISTINCT name, measurement_unit '
+                    'FROM ingredient_staging '
+                    'ON CONFLICT ON CONSTRAINT unique_ingredient DO NOTHING')
+        return total
 
-        # парсер ингридиентов
-        csv = process_file('ingredients.csv')
-        next(csv, None)
-        for row in csv:
-            obj, created = Ingredient.objects.get_or_create(
-                name=row[0],
-                measurement_unit=row[1])
-        print('парсер ингридиентов прошел успешно')
+    def diff(self, rows):
+        existing = set(Ingredient.objects.values_list(
+            'name', 'measurement_unit').iterator())
+        seen, new = set(), []
+        total = duplicates = 0
+        for row in rows:
+            total += 1
+            if row in seen:
+                duplicates += 1
+                continue
+            seen.add(row)
+            if row not in existing:
+                new.append(row)
+        for name, measurement_unit in new:
+            self.stdout.write(f'+ {name}, {measurement_unit}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк в файле: {total}, повторов в файле: {duplicates}, '
+            f'уже в базе: {len(seen) - len(new)}, '
+            f'будет добавлено: {len(new)}'))
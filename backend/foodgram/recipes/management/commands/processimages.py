@@ -0,0 +1,19 @@
+from recipes.images import make_renditions
+from recipes.management.worker import WorkerCommand
+from recipes.models import ImageTask
+
+
+class Command(WorkerCommand):
+    help = ('Фоновый обработчик очереди изображений: создаёт миниатюры '
+            'и WebP-копии загруженных изображений рецептов')
+    model = ImageTask
+    max_attempts_setting = 'IMAGE_TASK_MAX_ATTEMPTS'
+
+    def process(self, task):
+        make_renditions(task.recipe)
+        return 'готово'
+
+    def complete(self, task):
+        # Более ранние задачи того же рецепта уже неактуальны
+        ImageTask.objects.filter(
+            recipe_id=task.recipe_id, id__lte=task.id).delete()
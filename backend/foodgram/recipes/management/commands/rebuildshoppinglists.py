@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from foodgram.cache import bump_shopping_lists
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает агрегированные списки покупок по корзинам '
+            'или только сверяет их (--verify)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сравнить таблицу с корзинами, ничего не меняя')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            ShoppingListItem.objects.lock_users()
+            expected = ShoppingListItem.objects.ground_truth()
+            actual = {
+                (user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount in
+                ShoppingListItem.objects.values_list(
+                    'user_id', 'ingredient_id', 'total_amount').iterator()
+            }
+            mismatched = {
+                key for key in expected.keys() | actual.keys()
+                if expected.get(key) != actual.get(key)
+            }
+            if options['verify']:
+                for user_id, ingredient_id in sorted(mismatched):
+                    self.stdout.write(
+                        f'user={user_id} ingredient={ingredient_id}: '
+                        f'ожидалось {expected.get((user_id, ingredient_id))}, '
+                        f'в таблице {actual.get((user_id, ingredient_id))}')
+                if mismatched:
+                    raise CommandError(
+                        f'Расхождений в списках покупок: {len(mismatched)}')
+                self.stdout.write(self.style.SUCCESS(
+                    f'Списки покупок совпадают, позиций: {len(expected)}'))
+                return
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                                  total_amount=amount)
+                 for (user_id, ingredient_id), amount in expected.items()),
+                batch_size=1000
+            )
+        bump_shopping_lists()
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересобраны, позиций: {len(expected)}, '
+            f'исправлено расхождений: {len(mismatched)}'))
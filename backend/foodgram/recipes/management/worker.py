@@ -0,0 +1,61 @@
+from time import sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class WorkerCommand(BaseCommand):
+    """Общая команда фонового обработчика очереди задач рецептов.
+
+    Наследник задаёт model — модель очереди, max_attempts_setting —
+    имя настройки с числом попыток, и process(task), который выполняет
+    задачу и возвращает строку для вывода."""
+    model = None
+    max_attempts_setting = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Обработать очередь и завершиться')
+        parser.add_argument(
+            '--sleep', type=float, default=2,
+            help='Пауза в секундах, когда очередь пуста')
+
+    def handle(self, *args, **options):
+        while True:
+            if not self.process_next():
+                if options['once']:
+                    return
+                sleep(options['sleep'])
+
+    def process_next(self):
+        """Обрабатывает одну задачу; несколько обработчиков могут работать
+        параллельно — заблокированные задачи пропускаются"""
+        with transaction.atomic():
+            task = self.model.objects.select_for_update(
+                skip_locked=True, of=('self', )
+            ).select_related('recipe').filter(
+                attempts__lt=getattr(settings, self.max_attempts_setting)
+            ).first()
+            if task is None:
+                return False
+            try:
+                with transaction.atomic():
+                    result = self.process(task)
+            except Exception as error:
+                task.attempts += 1
+                task.error = repr(error)
+                task.save(update_fields=('attempts', 'error'))
+                self.stderr.write(f'{task.recipe}: {task.error}')
+                return True
+            self.complete(task)
+        self.stdout.write(f'{task.recipe}: {result}')
+        return True
+
+    def process(self, task):
+        raise NotImplementedError
+
+    def complete(self, task):
+        """Убирает выполненную задачу из очереди"""
+        task.delete()
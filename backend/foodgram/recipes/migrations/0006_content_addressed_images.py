@@ -0,0 +1,29 @@
+# Generated by Django 3.2 on 2026-10-18 06:14
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/', verbose_name='Изображение рецепта'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image_webp',
+            field=models.ImageField(blank=True, storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/webp/', verbose_name='Изображение рецепта в WebP'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='thumbnail',
+            field=models.ImageField(blank=True, storage=recipes.storage.ContentAddressedStorage(), upload_to='recipes/thumbnails/', verbose_name='Миниатюра рецепта'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2 on 2026-10-18 06:15
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+# GIN-индекс и заполнение векторов есть только в PostgreSQL,
+# в SQLite поиск работает без индекса
+CREATE_INDEX = '''
+CREATE INDEX recipe_search_vector_idx
+ON recipes_recipe USING gin (search_vector)
+'''
+DROP_INDEX = 'DROP INDEX IF EXISTS recipe_search_vector_idx'
+FILL_VECTORS = '''
+UPDATE recipes_recipe AS recipe SET search_vector =
+    setweight(to_tsvector(%s::regconfig, recipe.name), 'A')
+    || setweight(to_tsvector(%s::regconfig, coalesce((
+        SELECT string_agg(ingredient.name, ' ')
+        FROM recipes_recipeingredient AS recipe_ingredient
+        JOIN recipes_ingredient AS ingredient
+            ON ingredient.id = recipe_ingredient.ingredient_id
+        WHERE recipe_ingredient.recipe_id = recipe.id
+    ), '')), 'B')
+    || setweight(to_tsvector(%s::regconfig, recipe.text), 'C')
+'''
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_INDEX)
+        schema_editor.execute(FILL_VECTORS, [settings.SEARCH_CONFIG] * 3)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
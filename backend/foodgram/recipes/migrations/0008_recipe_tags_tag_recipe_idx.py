@@ -0,0 +1,22 @@
+from django.db import migrations
+
+# Промежуточная таблица тэгов создаётся Django автоматически, поэтому
+# индекс (tag_id, recipe_id) для фильтра по тэгам добавляется SQL.
+# Проверки избранного и корзины покрывают уникальные индексы
+# (user_id, recipe_id)
+CREATE_INDEX = '''
+CREATE INDEX recipe_tags_tag_recipe_idx
+ON recipes_recipe_tags (tag_id, recipe_id)
+'''
+DROP_INDEX = 'DROP INDEX IF EXISTS recipe_tags_tag_recipe_idx'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEX, DROP_INDEX),
+    ]
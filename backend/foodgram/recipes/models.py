@@ -1,6 +1,17 @@
+from collections import defaultdict
+
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField)
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import (Case, Exists, F, OuterRef, Prefetch, Q, Sum,
+                              Value, When, Window)
+from django.db.models.functions import RowNumber
+
+from foodgram.cache import bump_shopping_lists
+from recipes.storage import recipe_image_storage
 
 
 class Tag(models.Model):
@@ -52,6 +63,82 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Выборки рецептов для чтения через API"""
+
+    def search(self, text):
+        """Полнотекстовый поиск по названию, описанию и ингредиентам
+        с ранжированием по ts_rank. Вне PostgreSQL — поиск подстроки"""
+        if connections[self.db].vendor != 'postgresql':
+            return self.filter(
+                Q(name__icontains=text) | Q(text__icontains=text)
+                | Q(Exists(RecipeIngredient.objects.filter(
+                    recipe=OuterRef('pk'), ingredient__name__icontains=text)))
+            ).annotate(rank=Case(
+                When(name__icontains=text, then=Value(1.0)),
+                default=Value(0.5),
+            )).order_by('-rank', '-pub_date')
+        query = SearchQuery(text, config=settings.SEARCH_CONFIG,
+                            search_type='websearch')
+        return self.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', '-pub_date')
+
+    def update_search_vectors(self):
+        """Пересчитывает поисковые векторы рецептов выборки"""
+        if connections[self.db].vendor != 'postgresql':
+            return
+        names = defaultdict(list)
+        for recipe_id, name in RecipeIngredient.objects.filter(
+                recipe__in=self).values_list('recipe_id', 'ingredient__name'):
+            names[recipe_id].append(name)
+        for recipe_id in self.values_list('id', flat=True):
+            self.model.objects.filter(id=recipe_id).update(search_vector=(
+                SearchVector('name', weight='A',
+                             config=settings.SEARCH_CONFIG)
+                + SearchVector(Value(' '.join(names[recipe_id])), weight='B',
+                               config=settings.SEARCH_CONFIG)
+                + SearchVector('text', weight='C',
+                               config=settings.SEARCH_CONFIG)
+            ))
+
+    def with_related(self):
+        """Подгружает теги, ингредиенты и авторов фиксированным
+        числом запросов вне зависимости от размера страницы"""
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch('recipeingredients',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')),
+        )
+
+    def latest_for_authors(self, author_ids, limit=None):
+        """Последние рецепты каждого автора одним запросом.
+
+        Возвращает словарь {author_id: [рецепты]}; при заданном limit
+        рецепты отбираются через ROW_NUMBER() OVER (PARTITION BY author)."""
+        recipes = self.filter(author_id__in=author_ids).only(
+            'id', 'name', 'image', 'thumbnail', 'image_webp', 'cooking_time',
+            'author_id', 'pub_date')
+        if limit is not None:
+            ranked = recipes.annotate(recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )).order_by()
+            sql, params = ranked.query.sql_with_params()
+            recipes = self.raw(
+                f'SELECT * FROM ({sql}) ranked '
+                'WHERE ranked.recipe_rank <= %s '
+                'ORDER BY ranked.author_id, ranked.recipe_rank',
+                (*params, limit)
+            )
+        grouped = defaultdict(list)
+        for recipe in recipes:
+            grouped[recipe.author_id].append(recipe)
+        return grouped
+
+
 class Recipe(models.Model):
     """Модель рецепта"""
     author = models.ForeignKey(
@@ -67,7 +154,20 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         'Изображение рецепта',
-        upload_to='recipes/'
+        upload_to='recipes/',
+        storage=recipe_image_storage
+    )
+    thumbnail = models.ImageField(
+        'Миниатюра рецепта',
+        upload_to='recipes/thumbnails/',
+        storage=recipe_image_storage,
+        blank=True
+    )
+    image_webp = models.ImageField(
+        'Изображение рецепта в WebP',
+        upload_to='recipes/webp/',
+        storage=recipe_image_storage,
+        blank=True
     )
     text = models.TextField(
         verbose_name='Описание рецепта'
@@ -97,15 +197,36 @@ class Recipe(models.Model):
         'Дата публикации',
         auto_now_add=True
     )
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False
+    )
+    similar_stale = models.BooleanField(
+        'Похожие рецепты устарели',
+        default=True,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ('-pub_date', )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=('id', ), condition=Q(similar_stale=True),
+                         name='recipe_similar_stale_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def update_search_vector(self):
+        Recipe.objects.filter(id=self.id).update_search_vectors()
+
 
 class RecipeIngredient(models.Model):
     """Модель ингредиентов в рецепте"""
@@ -170,6 +291,9 @@ class Favorite(FavoriteAndShoppingCart):
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
+        constraints = [models.UniqueConstraint(
+            fields=('user', 'recipe'),
+            name='unique_recipe_in_user_favorited')]
 
 
 class ShoppingCart(FavoriteAndShoppingCart):
@@ -178,3 +302,268 @@ class ShoppingCart(FavoriteAndShoppingCart):
     class Meta:
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списки покупок'
+        constraints = [models.UniqueConstraint(
+            fields=('user', 'recipe'),
+            name='unique_recipe_in_user_shopping_cart')]
+
+
+class RecipeTask(models.Model):
+    """Общая модель задач фоновой обработки рецепта"""
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='%(class)ss',
+        verbose_name='Рецепт'
+    )
+    created = models.DateTimeField(
+        'Дата постановки в очередь',
+        auto_now_add=True
+    )
+    attempts = models.PositiveSmallIntegerField(
+        'Число попыток',
+        default=0
+    )
+    error = models.TextField(
+        'Последняя ошибка',
+        blank=True
+    )
+
+    class Meta:
+        abstract = True
+        ordering = ('id', )
+
+    def __str__(self):
+        return f'{self.recipe} ({self.attempts})'
+
+
+class ImageTask(RecipeTask):
+    """Задача фоновой обработки изображения рецепта"""
+
+    class Meta(RecipeTask.Meta):
+        verbose_name = 'Обработка изображения'
+        verbose_name_plural = 'Очередь обработки изображений'
+
+
+class FeedTask(RecipeTask):
+    """Задача фоновой рассылки нового рецепта в ленты подписчиков"""
+
+    class Meta(RecipeTask.Meta):
+        verbose_name = 'Рассылка в ленты'
+        verbose_name_plural = 'Очередь рассылки в ленты'
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписчика автора.
+
+    Дата публикации и автор копируются из рецепта, чтобы страница ленты
+    читалась диапазоном по индексу (user, -pub_date, -recipe)."""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timelineentries',
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [models.UniqueConstraint(
+            fields=('user', 'recipe'),
+            name='unique_timeline_entry')]
+        indexes = [models.Index(fields=('user', '-pub_date', '-recipe'),
+                                name='timeline_user_pub_date_idx')]
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe}'
+
+
+class SimilarRecipe(models.Model):
+    """Один из SIMILAR_RECIPES_COUNT самых похожих рецептов по составу
+    и тэгам. Таблица заполняется командой buildsimilar"""
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        verbose_name='Рецепт'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [models.UniqueConstraint(
+            fields=('recipe', 'similar'),
+            name='unique_similar_recipe')]
+        indexes = [models.Index(fields=('recipe', '-score'),
+                                name='similar_recipe_score_idx')]
+
+    def __str__(self):
+        return f'{self.recipe} ~ {self.similar} ({self.score:.2f})'
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    """Поддержка агрегированного списка покупок в актуальном состоянии.
+
+    Изменения применяются в транзакции вызывающего кода, а вне её — в
+    своей. Добавление и удаление строк корзины, в том числе каскадное,
+    переносят в списки сигналы."""
+
+    @staticmethod
+    def lock_users(user_ids=None):
+        """Блокирует пользователей в одном порядке, чтобы параллельные
+        изменения корзины одного пользователя не теряли строки; без
+        user_ids — всех"""
+        users = get_user_model().objects.select_for_update()
+        if user_ids is not None:
+            users = users.filter(id__in=user_ids)
+        list(users.order_by('id').values_list('id', flat=True))
+
+    @transaction.atomic(savepoint=False)
+    def apply_changes(self, changes):
+        """Применяет изменения вида {(user_id, ingredient_id): delta}"""
+        changes = {key: delta for key, delta in changes.items() if delta}
+        if not changes:
+            return
+        user_ids = {user_id for user_id, _ in changes}
+        ingredient_ids = {ingredient_id for _, ingredient_id in changes}
+        self.lock_users(user_ids)
+        items = {
+            (item.user_id, item.ingredient_id): item
+            for item in self.filter(user_id__in=user_ids,
+                                    ingredient_id__in=ingredient_ids)
+        }
+        to_create, to_update, to_delete = [], [], []
+        for (user_id, ingredient_id), delta in changes.items():
+            item = items.get((user_id, ingredient_id))
+            if item is None:
+                if delta > 0:
+                    to_create.append(self.model(
+                        user_id=user_id, ingredient_id=ingredient_id,
+                        total_amount=delta))
+                continue
+            item.total_amount += delta
+            if item.total_amount > 0:
+                to_update.append(item)
+            else:
+                to_delete.append(item.id)
+        self.bulk_create(to_create)
+        self.bulk_update(to_update, ('total_amount', ))
+        if to_delete:
+            self.filter(id__in=to_delete).delete()
+        transaction.on_commit(lambda: bump_shopping_lists(user_ids))
+
+    @staticmethod
+    def recipe_amounts(recipe_id):
+        """Состав рецепта: {ingredient_id: количество}"""
+        return dict(RecipeIngredient.objects.filter(
+            recipe_id=recipe_id).values('ingredient_id').annotate(
+            total=Sum('amount')).values_list('ingredient_id', 'total')
+            .order_by())
+
+    def recipe_changes(self, user_id, recipe_id, sign=1):
+        return {
+            (user_id, ingredient_id): sign * amount
+            for ingredient_id, amount in self.recipe_amounts(
+                recipe_id).items()
+        }
+
+    def add_recipe(self, user_id, recipe_id):
+        """Добавляет в список покупок пользователя ингредиенты рецепта"""
+        self.apply_changes(self.recipe_changes(user_id, recipe_id))
+
+    def remove_recipe(self, user_id, recipe_id):
+        """Убирает из списка покупок пользователя ингредиенты рецепта"""
+        self.apply_changes(self.recipe_changes(user_id, recipe_id, sign=-1))
+
+    def move_recipe(self, old, new):
+        """Переносит рецепт между парами (user_id, recipe_id) одним
+        изменением"""
+        changes = defaultdict(int, self.recipe_changes(*old, sign=-1))
+        for key, delta in self.recipe_changes(*new).items():
+            changes[key] += delta
+        self.apply_changes(changes)
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Переносит изменение состава рецепта в списки покупок всех
+        пользователей, у которых рецепт лежит в корзине"""
+        deltas = {
+            ingredient_id: (new_amounts.get(ingredient_id, 0)
+                            - old_amounts.get(ingredient_id, 0))
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        if not any(deltas.values()):
+            return
+        user_ids = ShoppingCart.objects.filter(
+            recipe=recipe).values_list('user_id', flat=True)
+        self.apply_changes({
+            (user_id, ingredient_id): delta
+            for user_id in user_ids
+            for ingredient_id, delta in deltas.items()
+        })
+
+    @staticmethod
+    def ground_truth(user_ids=None):
+        """Суммы ингредиентов, посчитанные напрямую по корзинам"""
+        rows = RecipeIngredient.objects.filter(
+            recipe__shoppingcarts__isnull=False)
+        if user_ids is not None:
+            rows = rows.filter(recipe__shoppingcarts__user_id__in=user_ids)
+        return {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in rows.values(
+                'recipe__shoppingcarts__user_id', 'ingredient_id'
+            ).annotate(amount=Sum('amount')).values_list(
+                'recipe__shoppingcarts__user_id', 'ingredient_id', 'amount'
+            ).order_by().iterator()
+        }
+
+
+class ShoppingListItem(models.Model):
+    """Агрегированный список покупок: сумма ингредиента
+    по всем рецептам из корзины пользователя"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='shoppinglistitems',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shoppinglistitems',
+        verbose_name='Ингредиент'
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name='Общее количество'
+    )
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списков покупок'
+        constraints = [models.UniqueConstraint(
+            fields=('user', 'ingredient'),
+            name='unique_shopping_list_item')]
+
+    def __str__(self):
+        return f'{self.user} - {self.ingredient}: {self.total_amount}'
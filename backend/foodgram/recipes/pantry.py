@@ -0,0 +1,203 @@
+from copy import copy
+
+import numpy as np
+from django.conf import settings
+
+from foodgram.cache import LocalCopy, get_cache
+from foodgram.db import primary
+
+VERSION_CACHE_KEY = 'pantry:index:version'
+CHANGES_CACHE_KEY = 'pantry:index:changes:{}:{}'
+# Сколько списков изменений можно записать под одной версией: при
+# неатомарном incr параллельные изменения получают одну версию
+CHANGE_SLOTS = 4
+
+
+def load_pairs(recipe_ids=None):
+    """Уникальные пары (ingredient_id, recipe_id) из основной базы"""
+    from recipes.models import RecipeIngredient
+
+    rows = RecipeIngredient.objects.values_list(
+        'ingredient_id', 'recipe_id').order_by()
+    if recipe_ids is not None:
+        rows = rows.filter(recipe_id__in=recipe_ids)
+    with primary():
+        return np.unique(np.array(list(rows.iterator()), dtype=np.int64)
+                         .reshape(-1, 2), axis=0)
+
+
+class Bitsets:
+    """Битовые множества рецептов по ингредиентам.
+
+    Строка — ингредиент, бит столбца — рецепт. Новые рецепты и
+    ингредиенты получают следующий свободный столбец или строку,
+    массивы при нехватке места растут вдвое. Столбец удалённого
+    рецепта остаётся пустым до полной пересборки."""
+
+    def __init__(self, pairs):
+        self.rows = {}
+        self.columns = {}
+        self.bitsets = np.zeros((0, 0), dtype=np.uint8)
+        self.recipe_ids = np.zeros(0, dtype=np.int64)
+        self.sizes = np.zeros(0, dtype=np.uint16)
+        self.add(pairs)
+
+    def copy(self):
+        bitsets = copy(self)
+        bitsets.rows, bitsets.columns = dict(self.rows), dict(self.columns)
+        bitsets.bitsets = self.bitsets.copy()
+        bitsets.recipe_ids = self.recipe_ids.copy()
+        bitsets.sizes = self.sizes.copy()
+        return bitsets
+
+    def clear(self, recipe_ids):
+        """Убирает рецепты из всех множеств"""
+        for recipe_id in recipe_ids:
+            column = self.columns.get(recipe_id)
+            if column is not None:
+                self.bitsets[:, column // 8] &= np.uint8(
+                    0xFF ^ 1 << (7 - column % 8))
+                self.sizes[column] = 0
+
+    def add(self, pairs):
+        """Добавляет пары (ingredient_id, recipe_id), которых ещё нет"""
+        for ids, positions in ((pairs[:, 0], self.rows),
+                               (pairs[:, 1], self.columns)):
+            for pk in np.unique(ids).tolist():
+                positions.setdefault(pk, len(positions))
+        self._grow(len(self.rows), len(self.columns))
+        rows = np.array([self.rows[pk] for pk in pairs[:, 0].tolist()],
+                        dtype=np.int64)
+        columns = np.array([self.columns[pk] for pk in pairs[:, 1].tolist()],
+                           dtype=np.int64)
+        self.recipe_ids[columns] = pairs[:, 1]
+        self.sizes += np.bincount(
+            columns, minlength=len(self.sizes)).astype(np.uint16)
+        # Бит рецепта — в байте columns // 8 строки ингредиента;
+        # биты одного байта объединяются reduceat по отсортированным
+        # номерам байтов
+        cells = rows * self.bitsets.shape[1] + columns // 8
+        bits = np.left_shift(1, 7 - columns % 8).astype(np.uint8)
+        order = np.argsort(cells, kind='stable')
+        cells, bits = cells[order], bits[order]
+        if len(cells):
+            starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+            self.bitsets.ravel()[cells[starts]] |= np.bitwise_or.reduceat(
+                bits, starts)
+
+    def _grow(self, rows, columns):
+        old_height, old_width = self.bitsets.shape
+        height = max(rows, old_height)
+        width = max((columns + 7) // 8, old_width)
+        if (height, width) == (old_height, old_width):
+            return
+        if old_height and height > old_height:
+            height = max(height, 2 * old_height)
+        if old_width and width > old_width:
+            width = max(width, 2 * old_width)
+        bitsets = np.zeros((height, width), dtype=np.uint8)
+        bitsets[:old_height, :old_width] = self.bitsets
+        recipe_ids = np.zeros(width * 8, dtype=np.int64)
+        recipe_ids[:len(self.recipe_ids)] = self.recipe_ids
+        sizes = np.zeros(width * 8, dtype=np.uint16)
+        sizes[:len(self.sizes)] = self.sizes
+        self.bitsets, self.recipe_ids, self.sizes = bitsets, recipe_ids, sizes
+
+    def search(self, ingredient_ids, missing):
+        rows = sorted({self.rows[pk] for pk in ingredient_ids
+                       if pk in self.rows})
+        if not rows:
+            return []
+        count = len(self.columns)
+        covered = np.unpackbits(
+            self.bitsets[rows], axis=1, count=count
+        ).sum(axis=0, dtype=np.uint16)
+        recipe_ids, sizes = self.recipe_ids[:count], self.sizes[:count]
+        lacking = sizes - covered
+        found = np.flatnonzero((covered > 0) & (lacking <= missing))
+        order = np.lexsort((-recipe_ids[found], lacking[found],
+                            -(covered[found] / sizes[found])))
+        return recipe_ids[found[order]].tolist()
+
+
+class PantryIndex:
+    """Инвертированный индекс ингредиент → рецепты в памяти процесса.
+
+    Для каждого ингредиента хранится битовое множество рецептов, где он
+    встречается, и число ингредиентов каждого рецепта. Сколько
+    ингредиентов рецепта есть у пользователя, считается сложением бит
+    его ингредиентов, без обращения к БД.
+
+    Индекс — копия с фоновой пересборкой (LocalCopy), версия сверяется
+    раз в PANTRY_INDEX_CHECK_INTERVAL секунд. Вместе с каждой версией в
+    общем кэше лежат списки id рецептов, чей состав изменился, каждый в
+    своём слоте, и процесс перечитывает только эти рецепты. Если
+    списка изменений нет или отставание больше PANTRY_INDEX_MAX_CHANGES
+    версий, индекс пересобирается целиком; так же раз в
+    PANTRY_INDEX_MAX_AGE секунд, на случай потерянных изменений."""
+
+    def __init__(self):
+        self._copy = LocalCopy(VERSION_CACHE_KEY,
+                               'PANTRY_INDEX_CHECK_INTERVAL',
+                               'PANTRY_INDEX_MAX_AGE', background=True)
+
+    def invalidate(self, recipe_ids=None):
+        """Увеличивает общую версию и запоминает изменённые рецепты;
+        без recipe_ids все процессы пересоберут индекс целиком, а этот
+        процесс — синхронно при следующем поиске. Возвращает версию"""
+        version = self._copy.invalidate(drop=recipe_ids is None)
+        if recipe_ids is None:
+            return version
+        cache = get_cache()
+        timeout = settings.PANTRY_INDEX_CHANGES_TIMEOUT
+        for slot in range(CHANGE_SLOTS):
+            if cache.add(CHANGES_CACHE_KEY.format(version, slot),
+                         sorted(recipe_ids), timeout):
+                return version
+        # Все слоты заняты: версию не восстановить, другие процессы
+        # пересоберут индекс целиком
+        cache.set(CHANGES_CACHE_KEY.format(version, 'lost'), True, timeout)
+        return version
+
+    def search(self, ingredient_ids, missing=0):
+        """id рецептов, для которых не хватает не больше missing
+        ингредиентов из ingredient_ids: сначала с наибольшей долей
+        имеющихся ингредиентов, затем с меньшим числом недостающих,
+        затем новые"""
+        return self._copy.get(self._build, self._update).search(
+            ingredient_ids, missing)
+
+    @staticmethod
+    def _build():
+        return Bitsets(load_pairs())
+
+    def _update(self, bitsets, old, new):
+        """Копия индекса с перечитанными изменёнными рецептами"""
+        recipe_ids = self._changes(old, new)
+        if recipe_ids is None:
+            return None
+        bitsets = bitsets.copy()
+        bitsets.clear(recipe_ids)
+        bitsets.add(load_pairs(recipe_ids))
+        return bitsets
+
+    @staticmethod
+    def _changes(old, new):
+        """id рецептов, изменённых после версии old до new, или None,
+        если изменения нельзя восстановить"""
+        if not old < new <= old + settings.PANTRY_INDEX_MAX_CHANGES:
+            return None
+        versions = range(old + 1, new + 1)
+        changes = get_cache().get_many([
+            CHANGES_CACHE_KEY.format(version, slot)
+            for version in versions
+            for slot in (*range(CHANGE_SLOTS), 'lost')
+        ])
+        if any(CHANGES_CACHE_KEY.format(version, 0) not in changes
+               or CHANGES_CACHE_KEY.format(version, 'lost') in changes
+               for version in versions):
+            return None
+        return set().union(*changes.values())
+
+
+pantry_index = PantryIndex()
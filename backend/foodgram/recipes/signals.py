@@ -0,0 +1,103 @@
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from recipes.autocomplete import ingredient_index
+from recipes.feed import backfill, prune
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingListItem)
+from recipes.pantry import pantry_index
+from recipes.similar import mark_neighbours_stale
+from users.models import Subscribe
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def invalidate_pantry_index(instance, **kwargs):
+    recipe_ids = (instance.recipe_id, )
+    transaction.on_commit(lambda: pantry_index.invalidate(recipe_ids))
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_pantry_index_on_save(instance, update_fields, **kwargs):
+    """Состав меняется массовыми операциями без сигналов вместе с
+    полным сохранением рецепта; сохранение отдельных полей, например
+    копий изображения, индекс не затрагивает"""
+    if update_fields is None:
+        recipe_ids = (instance.id, )
+        transaction.on_commit(lambda: pantry_index.invalidate(recipe_ids))
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_search_vector(instance, update_fields, **kwargs):
+    """Вектор пересчитывается после коммита, когда состав рецепта уже
+    записан массовыми операциями сериализатора"""
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        transaction.on_commit(instance.update_search_vector)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def refresh_recipe_search_vector(instance, **kwargs):
+    """Правки состава в админке, в том числе во вставке рецепта"""
+    recipe_id = instance.recipe_id
+    transaction.on_commit(lambda: Recipe.objects.filter(
+        id=recipe_id).update_search_vectors())
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_ingredient_search_vectors(instance, created, **kwargs):
+    """Название ингредиента входит в векторы всех рецептов с ним"""
+    if not created:
+        ingredient_id = instance.id
+        transaction.on_commit(lambda: Recipe.objects.filter(
+            recipeingredients__ingredient_id=ingredient_id
+        ).update_search_vectors())
+
+
+@receiver(pre_delete, sender=Recipe)
+def invalidate_similar_recipes(instance, **kwargs):
+    mark_neighbours_stale(instance)
+
+
+@receiver(pre_save, sender=ShoppingCart)
+def move_shopping_cart(instance, **kwargs):
+    """Правка строки корзины в админке переносит рецепт между списками"""
+    if instance.pk is None:
+        return
+    old = ShoppingCart.objects.filter(pk=instance.pk).values_list(
+        'user_id', 'recipe_id').first()
+    if old is not None and old != (instance.user_id, instance.recipe_id):
+        ShoppingListItem.objects.move_recipe(
+            old, (instance.user_id, instance.recipe_id))
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(instance, created, **kwargs):
+    if created:
+        ShoppingListItem.objects.add_recipe(instance.user_id,
+                                            instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(instance, **kwargs):
+    """Срабатывает и при каскадном удалении рецепта или пользователя,
+    пока состав рецепта ещё в базе"""
+    ShoppingListItem.objects.remove_recipe(instance.user_id,
+                                           instance.recipe_id)
+
+
+@receiver(post_save, sender=Subscribe)
+def backfill_timeline(instance, created, **kwargs):
+    if created:
+        transaction.on_commit(
+            lambda: backfill(instance.user_id, instance.following_id))
+
+
+@receiver(post_delete, sender=Subscribe)
+def prune_timeline(instance, **kwargs):
+    prune(instance.user_id, instance.following_id)
@@ -0,0 +1,164 @@
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Min
+from scipy import sparse
+
+from recipes.models import Recipe, RecipeIngredient, SimilarRecipe
+
+# Сколько ячеек плотной матрицы сходства считается за один блок:
+# ограничивает память независимо от числа рецептов
+BLOCK_CELLS = 2 ** 22
+
+
+class Features:
+    """Разреженная матрица рецепт × (ингредиенты и тэги).
+
+    Сходство двух рецептов — взвешенный коэффициент Жаккара: вес общих
+    ингредиентов и тэгов, делённый на вес их объединения. Совпадение
+    тэга весит SIMILAR_RECIPES_TAG_WEIGHT от совпадения ингредиента."""
+
+    def __init__(self):
+        self.recipe_ids = np.fromiter(
+            Recipe.objects.order_by('id').values_list('id', flat=True),
+            dtype=np.int64)
+        ingredients = np.array(list(
+            RecipeIngredient.objects.values_list(
+                'recipe_id', 'ingredient_id').order_by()
+        ), dtype=np.int64).reshape(-1, 2)
+        tags = np.array(list(
+            Recipe.tags.through.objects.values_list(
+                'recipe_id', 'tag_id').order_by()
+        ), dtype=np.int64).reshape(-1, 2)
+        ingredient_ids, ingredient_columns = np.unique(
+            ingredients[:, 1], return_inverse=True)
+        tag_ids, tag_columns = np.unique(tags[:, 1], return_inverse=True)
+        rows = self.rows(np.concatenate((ingredients[:, 0], tags[:, 0])))
+        columns = np.concatenate(
+            (ingredient_columns, tag_columns + len(ingredient_ids)))
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+            shape=(len(self.recipe_ids),
+                   len(ingredient_ids) + len(tag_ids)))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        weights = np.ones(matrix.shape[1], dtype=np.float32)
+        weights[len(ingredient_ids):] = settings.SIMILAR_RECIPES_TAG_WEIGHT
+        self.matrix = matrix
+        self.weighted = (matrix @ sparse.diags(weights)).T.tocsr()
+        self.sizes = matrix @ weights
+
+    def rows(self, recipe_ids):
+        """Номера строк матрицы для id рецептов"""
+        return np.searchsorted(self.recipe_ids, recipe_ids)
+
+    def scores(self, rows):
+        """Блоки (строки, сходство строк со всеми рецептами)"""
+        block_size = max(1, BLOCK_CELLS // max(1, len(self.recipe_ids)))
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            overlap = (self.matrix[block] @ self.weighted).toarray()
+            union = self.sizes[block, None] + self.sizes[None, :] - overlap
+            scores = np.divide(overlap, union, out=np.zeros_like(overlap),
+                               where=union > 0)
+            scores[np.arange(len(block)), block] = 0
+            yield block, scores
+
+    def neighbours(self, block, scores, count):
+        """SIMILAR_RECIPES_COUNT лучших соседей для каждой строки блока"""
+        count = min(count, scores.shape[1] - 1)
+        if count <= 0:
+            return []
+        top = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [
+            SimilarRecipe(recipe_id=int(self.recipe_ids[row]),
+                          similar_id=int(self.recipe_ids[column]),
+                          score=float(score))
+            for row, columns, row_scores in zip(block, top, top_scores)
+            for column, score in zip(columns, row_scores) if score > 0
+        ]
+
+
+def mark_neighbours_stale(recipe):
+    """Рецепты, у которых удаляемый рецепт есть среди соседей, будут
+    пересчитаны при следующем запуске buildsimilar"""
+    Recipe.objects.filter(similar_recipes__similar=recipe).update(
+        similar_stale=True)
+
+
+def stale_recipe_ids():
+    return list(Recipe.objects.filter(
+        similar_stale=True).values_list('id', flat=True))
+
+
+def clear_stale(recipe_ids, batch_size=1000):
+    """Снимает отметку только с рецептов, прочитанных до сборки
+    признаков: отмеченные во время пересчёта дождутся следующего"""
+    for start in range(0, len(recipe_ids), batch_size):
+        Recipe.objects.filter(
+            id__in=recipe_ids[start:start + batch_size], similar_stale=True
+        ).update(similar_stale=False)
+
+
+def save(recipe_ids, neighbours, batch_size=1000):
+    for start in range(0, len(recipe_ids), batch_size):
+        SimilarRecipe.objects.filter(
+            recipe_id__in=recipe_ids[start:start + batch_size]).delete()
+    SimilarRecipe.objects.bulk_create(neighbours, batch_size=batch_size)
+
+
+def build():
+    """Пересчитывает соседей всех рецептов. Возвращает число рецептов"""
+    stale_ids = stale_recipe_ids()
+    features = Features()
+    count = settings.SIMILAR_RECIPES_COUNT
+    SimilarRecipe.objects.all().delete()
+    for block, scores in features.scores(
+            np.arange(len(features.recipe_ids))):
+        SimilarRecipe.objects.bulk_create(
+            features.neighbours(block, scores, count), batch_size=1000)
+    clear_stale(stale_ids)
+    return len(features.recipe_ids)
+
+
+def refresh(stale_ids):
+    """Пересчитывает соседей рецептов, у которых изменился состав или
+    тэги, и тех рецептов, чей список соседей от этого может измениться:
+    в нём уже есть изменённый рецепт или изменённый рецепт стал похож
+    сильнее последнего из соседей. stale_ids читаются до вызова.
+    Возвращает число пересчитанных"""
+    features = Features()
+    count = settings.SIMILAR_RECIPES_COUNT
+    captured_ids = stale_ids
+    stale_ids = np.intersect1d(features.recipe_ids, stale_ids)
+    affected = np.zeros(len(features.recipe_ids), dtype=bool)
+    affected[features.rows(stale_ids)] = True
+    listed = np.fromiter(
+        SimilarRecipe.objects.filter(similar_id__in=stale_ids.tolist())
+        .values_list('recipe_id', flat=True).distinct().order_by(),
+        dtype=np.int64)
+    affected[features.rows(listed)] = True
+    # Порог попадания в список: сходство последнего из соседей,
+    # у неполных списков — любое ненулевое
+    lists = np.array(list(
+        SimilarRecipe.objects.values('recipe_id').annotate(
+            lowest=Min('score'), neighbours=Count('id')
+        ).order_by().values_list('recipe_id', 'lowest', 'neighbours')
+    ), dtype=np.float64).reshape(-1, 3)
+    full = lists[lists[:, 2] >= count]
+    thresholds = np.zeros(len(features.recipe_ids), dtype=np.float32)
+    thresholds[features.rows(full[:, 0].astype(np.int64))] = full[:, 1]
+    neighbours = []
+    for block, scores in features.scores(features.rows(stale_ids)):
+        affected |= (scores > thresholds[None, :]).any(axis=0)
+        neighbours.extend(features.neighbours(block, scores, count))
+    rest = np.setdiff1d(np.flatnonzero(affected), features.rows(stale_ids))
+    for block, scores in features.scores(rest):
+        neighbours.extend(features.neighbours(block, scores, count))
+    refreshed = features.recipe_ids[affected].tolist()
+    save(refreshed, neighbours)
+    clear_stale(captured_ids)
+    return len(refreshed)
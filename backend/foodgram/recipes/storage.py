@@ -0,0 +1,41 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла — хэш его содержимого.
+
+    Одинаковые изображения записываются на диск один раз: повторное
+    сохранение тех же байтов возвращает имя уже существующего файла.
+    Содержимое файла по имени никогда не меняется, поэтому его можно
+    кэшировать навсегда. Неиспользуемые файлы удаляет команда gcmedia."""
+
+    def get_content_name(self, name, content):
+        """Имя, под которым content будет сохранён вместо name"""
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], f'{digest}{extension}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        name = self.get_content_name(name, content)
+        if self.exists(name):
+            # Обновляем время изменения, чтобы сборщик мусора
+            # не удалил файл, на который вот-вот сошлётся запись
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
+
+
+recipe_image_storage = ContentAddressedStorage()
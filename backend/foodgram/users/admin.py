@@ -6,9 +6,13 @@ from users.models import Subscribe, User
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = ('username', 'first_name', 'last_name', 'email')
-    list_filter = ('first_name', 'email')
+    list_filter = ('is_active', 'is_staff')
+    search_fields = ('username', 'email', 'first_name', 'last_name')
 
 
 @admin.register(Subscribe)
 class SubscribeAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'following')
+    list_select_related = ('user', 'following')
+    search_fields = ('user__username', 'following__username')
+    autocomplete_fields = ('user', 'following')